@@ -0,0 +1,299 @@
+"""
+Startup and command latency benchmarks of the slash CLI.
+
+Every command runs in a fresh interpreter with HOME pointing to a temporary directory, so the benchmarks never
+touch the real WORK_DIR and need no network. The service of the base env is stubbed with a sleeping process.
+
+Usage:
+    python benchmarks/run.py                     # print the results
+    python benchmarks/run.py -o results.json     # also write them as json
+    python benchmarks/run.py --check             # exit 1 if a benchmark exceeds its threshold
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+
+ROOT = Path(__file__).resolve().parent.parent
+THRESHOLDS_PATH = Path(__file__).resolve().parent / "thresholds.json"
+
+# the slash console script, without depending on it being installed
+CLI = "import sys; from slash import main; sys.argv[0] = 'slash'; main()"
+
+# time an in-process operation in a fresh interpreter, print the elapsed seconds
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import slash
+slash.Slash
+print(time.perf_counter() - start)
+"""
+
+ENVS_SCRIPT = """
+import time
+from slash.core import EnvsManager
+manager = EnvsManager()
+start = time.perf_counter()
+manager.envs
+print(time.perf_counter() - start)
+"""
+
+# a second access within the same process, as a command does several times
+ENVS_WARM_SCRIPT = """
+import time
+from slash.core import EnvsManager
+manager = EnvsManager()
+manager.envs
+start = time.perf_counter()
+manager.envs
+manager.get_env("base")
+print(time.perf_counter() - start)
+"""
+
+ENV_COUNTS = [1, 10, 100, 1000]
+
+# the size of the generated config for the codec benchmarks
+CONFIG_PROXIES = 5000
+CONFIG_RULES = 20000
+
+
+def make_config(proxies: int, rules: int) -> dict:
+    """
+    A mihomo config of the size produced by large subscriptions.
+    """
+    nodes = [
+        {
+            "name": f"HK {i:04d} | Hong Kong", "type": "ss", "server": f"node{i}.example.com", "port": 10000 + i,
+            "cipher": "aes-256-gcm", "password": f"password{i}", "udp": True,
+        }
+        for i in range(proxies)
+    ]
+    names = [node["name"] for node in nodes]
+    return {
+        "mixed-port": 7890,
+        "allow-lan": False,
+        "mode": "rule",
+        "proxies": nodes,
+        "proxy-groups": [
+            {"name": "Select", "type": "select", "proxies": ["Auto", *names]},
+            {"name": "Auto", "type": "url-test", "url": "http://www.gstatic.com/generate_204", "interval": 300, "proxies": names},
+        ],
+        "rules": [f"DOMAIN-SUFFIX,site{i}.example.com,Select" for i in range(rules)] + ["MATCH,Select"],
+    }
+
+
+def run_codec_benchmarks(repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Load and dump a large config.yaml with each codec, in this process.
+    """
+    sys.path.insert(0, str(ROOT))
+    from slash.core.codec import ConfigSnapshot, config_codec, roundtrip_codec
+
+    results: Dict[str, Dict[str, float]] = {}
+    size = f"{CONFIG_PROXIES} proxies, {CONFIG_RULES} rules"
+    with tempfile.TemporaryDirectory(prefix="slash-bench-") as tmp:
+        path = Path(tmp) / "config.yaml"
+        data = make_config(CONFIG_PROXIES, CONFIG_RULES)
+        with open(path, "w") as f:
+            config_codec.dump(data, f)
+
+        # the round-trip codec is only a reference, it takes seconds per run
+        for codec, runs, warmup in [(config_codec, repeat, True), (roundtrip_codec, 1, False)]:
+            def load() -> float:
+                with open(path, "r") as f:
+                    return timed(lambda: codec.load(f))
+
+            def dump() -> float:
+                with open(Path(tmp) / "dump.yaml", "w") as f:
+                    return timed(lambda: codec.dump(data, f))
+
+            for name, fn in [("load", load), ("dump", dump)]:
+                name = f"{codec.name} {name} ({size})"
+                results[name] = measure(fn, runs, warmup)
+                print(f"{name:<48} {results[name]['median'] * 1000:9.1f} ms", file=sys.stderr)
+
+        # an unchanged config, as on every activation; the warm-up takes the snapshot
+        snapshot = ConfigSnapshot(path, config_codec)
+        name = f"snapshot load ({size})"
+        results[name] = measure(lambda: timed(snapshot.load), repeat)
+        print(f"{name:<48} {results[name]['median'] * 1000:9.1f} ms", file=sys.stderr)
+
+        print(f"libyaml accelerated: {config_codec.accelerated}", file=sys.stderr)
+    return results
+
+
+class Sandbox:
+    """
+    A temporary HOME with a base env and a stubbed service.
+    """
+    def __init__(self) -> None:
+        self._temp_dir = tempfile.TemporaryDirectory(prefix="slash-bench-")
+        self.home = Path(self._temp_dir.name)
+        self.work_dir = self.home / ".cache" / "slash"
+        self.env = dict(os.environ, HOME=str(self.home), PYTHONPATH=str(ROOT))
+        for key in ["http_proxy", "https_proxy", "SLASH_ENV", "SLASH_STASH"]:
+            self.env.pop(key, None)
+        self.stub: Optional[subprocess.Popen] = None
+
+    def run(self, args: List[str], env: Optional[Dict[str, str]] = None) -> str:
+        out = subprocess.run(
+            [sys.executable, *args], env=dict(self.env, **(env or {})), cwd=self.home,
+            capture_output=True, text=True, check=True,
+        )
+        return out.stdout
+
+    def slash(self, *args: str, env: Optional[Dict[str, str]] = None) -> str:
+        return self.run(["-c", CLI, *args], env=env)
+
+    def setup_service(self) -> None:
+        """
+        Create the base env, and pretend its service is running on this host.
+        """
+        self.slash("env", "list")
+        self.stub = subprocess.Popen(["sleep", "3600"])
+        service = {
+            socket.gethostname(): {
+                "pid": self.stub.pid,
+                "port": 7890,
+                "ctl": [9090, "secret"],
+                # keeps the service alive when the benchmark deactivates its shell
+                "jobs": [f"__pid_{os.getpid()}_bench__"],
+            }
+        }
+        with open(self.work_dir / "envs" / "base" / "service.json", "w") as f:
+            json.dump(service, f)
+
+    def make_envs(self, count: int) -> None:
+        envs_dir = self.work_dir / "envs"
+        envs_dir.mkdir(parents=True, exist_ok=True)
+        for env_dir in envs_dir.iterdir():
+            if env_dir.name != "base":
+                for path in env_dir.iterdir():
+                    path.unlink()
+                env_dir.rmdir()
+        for i in range(count - 1):
+            (envs_dir / f"env{i}").mkdir()
+            with open(envs_dir / f"env{i}" / "env.json", "w") as f:
+                json.dump({"name": f"env{i}", "subscriptions": None, "last_updated": None}, f)
+
+    def cleanup(self) -> None:
+        # the process daemons started by `shell activate`
+        for process in psutil.process_iter():
+            try:
+                if process.pid != os.getpid() and process.environ().get("HOME") == str(self.home):
+                    process.terminate()
+            except (psutil.AccessDenied, psutil.NoSuchProcess, psutil.ZombieProcess):
+                pass
+        if self.stub is not None:
+            self.stub.kill()
+            self.stub.wait()
+        self._temp_dir.cleanup()
+
+
+def timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def measure(fn: Callable[[], float], repeat: int, warmup: bool = True) -> Dict[str, float]:
+    """
+    Run fn repeat times, after a warm-up by default. fn returns the seconds taken by the part being measured.
+    """
+    if warmup:
+        fn()
+    times = [fn() for _ in range(repeat)]
+    return {"min": min(times), "median": statistics.median(times), "max": max(times), "runs": repeat}
+
+
+def run_benchmarks(repeat: int) -> Dict[str, Dict[str, float]]:
+    sandbox = Sandbox()
+    results: Dict[str, Dict[str, float]] = {}
+
+    def report(name: str, fn: Callable[[], float]) -> None:
+        results[name] = measure(fn, repeat)
+        print(f"{name:<48} {results[name]['median'] * 1000:9.1f} ms", file=sys.stderr)
+
+    try:
+        sandbox.setup_service()
+        shell_pid = str(os.getpid())
+        activate = ["shell", "activate", "base", "--shell_pid", shell_pid]
+        deactivate = ["shell", "deactivate", "--shell_pid", shell_pid]
+        active = {"SLASH_ENV": "base"}
+
+        def activate_deactivate() -> float:
+            elapsed = timed(lambda: sandbox.slash(*activate))
+            return elapsed + timed(lambda: sandbox.slash(*deactivate, env=active))
+
+        report("python startup", lambda: timed(lambda: sandbox.run(["-c", "pass"])))
+        report("import slash", lambda: float(sandbox.run(["-c", IMPORT_SCRIPT])))
+        report("slash --help", lambda: timed(lambda: sandbox.slash("--help")))
+        report("slash shell hook", lambda: timed(lambda: sandbox.slash("shell", "hook")))
+        report("slash env list", lambda: timed(lambda: sandbox.slash("env", "list")))
+        report("slash env info", lambda: timed(lambda: sandbox.slash("env", "info", "-n", "base")))
+        report("slash shell activate+deactivate", activate_deactivate)
+
+        for count in ENV_COUNTS:
+            sandbox.make_envs(count)
+            report(f"EnvsManager.envs ({count} envs)", lambda: float(sandbox.run(["-c", ENVS_SCRIPT])))
+            report(f"EnvsManager.envs warm ({count} envs)", lambda: float(sandbox.run(["-c", ENVS_WARM_SCRIPT])))
+    finally:
+        sandbox.cleanup()
+
+    return results
+
+
+def check(results: Dict[str, Dict[str, float]], thresholds: Dict[str, float]) -> List[str]:
+    """
+    Compare the median of each benchmark against its threshold (seconds).
+    """
+    failures = []
+    for name, threshold in thresholds.items():
+        if name in results and results[name]["median"] > threshold:
+            failures.append(f"{name}: {results[name]['median'] * 1000:.1f} ms > {threshold * 1000:.1f} ms")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the startup and command latency of slash.")
+    parser.add_argument("-o", "--output", help="Write the results to this json file", default=None)
+    parser.add_argument("-r", "--repeat", help="The number of runs of each benchmark", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help=f"Fail if a benchmark exceeds its threshold in {THRESHOLDS_PATH.name}")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat)
+    results.update(run_codec_benchmarks(args.repeat))
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.check:
+        with open(THRESHOLDS_PATH, "r") as f:
+            thresholds = json.load(f)
+        failures = check(results, thresholds)
+        for failure in failures:
+            print(f"REGRESSION {failure}", file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,12 @@
-from .cli import main
-from .slash import Slash
+# The submodules are imported on first access, so that `import slash` stays cheap.
+__all__ = ["Slash", "main"]
+
+
+def __getattr__(name: str):
+    if name == "main":
+        from .cli import main
+        return main
+    if name == "Slash":
+        from .slash import Slash
+        return Slash
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,7 +6,7 @@ import sys
 from pathlib import Path
 
 import slash.utils as utils
-from slash.core import CONFIG_PATH, initialize, shell
+from slash.core import CONFIG_PATH, bundle, initialize, shell
 from slash.slash import Slash
 
 
@@ -49,6 +49,7 @@ def get_parser():
     # slash run
     parser_run = argparse.ArgumentParser(add_help=False, description='Run a command with a Slash environment')
     parser_run.add_argument('-n', '--name', help='The name of the environment', default='base')
+    parser_run.add_argument('--exec', action='store_true', help='Replace slash with the command instead of waiting for it, so that no Python process stays alive during the job')
     parser_run.add_argument('args', nargs=argparse.REMAINDER, help='The command to run')
     subparsers.add_parser('run', parents=[parser_run], help=parser_run.description, description=parser_run.description)
 
@@ -84,6 +85,7 @@ def get_parser():
 
     # slash shell hook
     parser_hook = argparse.ArgumentParser(add_help=False, description='Hook the shell')
+    parser_hook.add_argument('--write', action='store_true', help='Also cache the hook for the shell configuration file to source')
     subparsers_shell.add_parser('hook', parents=[parser_hook], help=parser_hook.description, description=parser_hook.description)
 
     # slash shell activate
@@ -116,7 +118,10 @@ def get_parser():
 
     # slash env update
     parser_update = argparse.ArgumentParser(add_help=False, description='Update a Slash environment')
+    parser_update.add_argument('names', nargs='*', metavar='ENV_NAME', help='The names of the environments, updated concurrently')
     parser_update.add_argument('-n', '--name', help='The name of the environment', default=None)
+    parser_update.add_argument('-a', '--all', action='store_true', help='Update all environments')
+    parser_update.add_argument('-j', '--jobs', type=int, default=4, help='The maximum number of environments updated at the same time')
     subparsers_env.add_parser('update', parents=[parser_update], help=parser_update.description, description=parser_update.description)
 
     # slash env info
@@ -153,6 +158,23 @@ def get_parser():
 
     subparsers.add_parser('config', parents=[parser_env], help=parser_env.description, description=parser_env.description)
 
+
+    ## bundle subparsers
+    parser_bundle = argparse.ArgumentParser(add_help=False, description='Pack or unpack the artifacts needed by Slash, for machines without Internet access.')
+    subparsers_bundle = parser_bundle.add_subparsers(title='bundle_commands', dest='bundle_command', required=True, help="Bundle commands, used to move the artifacts to an offline machine")
+
+    # slash bundle export
+    parser_bundle_export = argparse.ArgumentParser(add_help=False, description='Pack every artifact needed to launch a service into one archive.')
+    parser_bundle_export.add_argument('-o', '--output', help='The path to the archive', default='slash-bundle.tar.gz')
+    subparsers_bundle.add_parser('export', parents=[parser_bundle_export], help=parser_bundle_export.description, description=parser_bundle_export.description)
+
+    # slash bundle import
+    parser_bundle_import = argparse.ArgumentParser(add_help=False, description='Seed the local cache from an archive created by `slash bundle export`.')
+    parser_bundle_import.add_argument('file', help='The path to the archive')
+    subparsers_bundle.add_parser('import', parents=[parser_bundle_import], help=parser_bundle_import.description, description=parser_bundle_import.description)
+
+    subparsers.add_parser('bundle', parents=[parser_bundle], help=parser_bundle.description, description=parser_bundle.description)
+
     return main_parser
 
 
@@ -161,8 +183,14 @@ def main(*args, **kwargs):
     args = get_parser().parse_args()
 
     if args.command == "run":
-        with Slash(env_name=args.name):
-            os.system(shlex.join(args.args))
+        if args.exec:
+            if not args.args:
+                logger.error("No command to run.")
+                sys.exit(1)
+            Slash(env_name=args.name).exec(args.args)
+        else:
+            with Slash(env_name=args.name):
+                os.system(shlex.join(args.args))
 
     elif args.command == "init":
         if args.reverse:
@@ -187,6 +215,8 @@ def main(*args, **kwargs):
     elif args.command == "shell":
 
         if args.shell_command == "hook":
+            if args.write:
+                shell.write_hook(slash_exe)
             print(shell.hook(slash_exe))
 
         elif args.shell_command == "activate":
@@ -258,13 +288,21 @@ def main(*args, **kwargs):
                 logger.info(line)
 
         elif args.env_command == "update":
-            name = args.name if args.name is not None else os.environ.get("SLASH_ENV", None)
-            if name is None:
-                logger.error("No environment is activated. Please specify the environment name with the `-n` flag.")
-                sys.exit(1)
+            names = list(Slash.list()) if args.all else args.names + ([args.name] if args.name is not None else [])
+            if len(names) > 1:
+                failed = Slash.update_many(names, workers=args.jobs)
+                if failed:
+                    logger.error(f"Failed to update {len(failed)} of {len(names)} environments: {', '.join(failed)}")
+                    sys.exit(1)
+                logger.info(f"{len(names)} environments updated.")
             else:
-                Slash(name).update()
-                logger.info(f"Environment '{name}' updated.")
+                name = names[0] if names else os.environ.get("SLASH_ENV", None)
+                if name is None:
+                    logger.error("No environment is activated. Please specify the environment name with the `-n` flag.")
+                    sys.exit(1)
+                else:
+                    Slash(name).update()
+                    logger.info(f"Environment '{name}' updated.")
 
         elif args.env_command == "info":
             name = args.name if args.name is not None else os.environ.get("SLASH_ENV", None)
@@ -300,3 +338,11 @@ def main(*args, **kwargs):
         elif args.config_command == "remove-key":
             Slash.config.remove_key(args.KEY)
             logger.info(f"Removed '{args.KEY}'.")
+
+    elif args.command == "bundle":
+
+        if args.bundle_command == "export":
+            bundle.export_bundle(Path(args.output).resolve())
+
+        elif args.bundle_command == "import":
+            bundle.import_bundle(Path(args.file).resolve())
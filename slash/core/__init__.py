@@ -4,3 +4,4 @@ from .constants import CONFIG_PATH, ENVS_DIR, WORK_DIR
 from .envs import Env, EnvsManager
 from .initialize import reversed_shell_initialize, shell_initialize
 from .service import Service, ServiceManager
+from .store import ArtifactStore
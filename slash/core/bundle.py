@@ -0,0 +1,148 @@
+import io
+import json
+import os
+import shutil
+import stat
+import tarfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import slash.utils as utils
+from slash.core.envs import (
+    GEOIP_KEY,
+    SUBCONVERTER_KEY,
+    TEMPLATE_KEY,
+    get_geoip,
+    get_subconverter_tarball,
+    get_template,
+)
+from slash.core.service import MIHOMO_KEY, YACD_KEY, get_mihomo, get_yacd_tarball
+from slash.core.store import ArtifactStore, sha256sum
+
+
+logger = utils.logger
+
+# the version of the bundle layout
+BUNDLE_FORMAT = 1
+
+# every artifact needed to launch a service, and how to fetch it
+ARTIFACTS: Dict[str, Callable[[], Path]] = {
+    MIHOMO_KEY: get_mihomo,
+    YACD_KEY: get_yacd_tarball,
+    SUBCONVERTER_KEY: get_subconverter_tarball,
+    TEMPLATE_KEY: get_template,
+    GEOIP_KEY: get_geoip,
+}
+
+def slash_version() -> str:
+    from importlib import metadata
+    try:
+        return metadata.version("slash-py")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+def export_bundle(path: Path) -> Path:
+    """
+    Pack every artifact needed to launch a service into one archive, for the nodes without Internet access.
+
+    The archive starts with ``manifest.json``, which lists the key, sha256 digest, size and mode of each
+    artifact, followed by the blobs as ``blobs/<sha256>``. Missing artifacts are downloaded first.
+
+    Arguments:
+        path: Path
+            The path to the archive.
+
+    Returns:
+        path: Path
+            The path to the archive.
+    """
+    artifacts: List[dict] = []
+    blobs: Dict[str, Path] = {}
+    for key, fetch in ARTIFACTS.items():
+        blob = fetch()
+        st = blob.stat()
+        artifacts.append({"key": key, "sha256": blob.name, "size": st.st_size, "mode": stat.S_IMODE(st.st_mode)})
+        blobs[blob.name] = blob
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": slash_version(),
+        "created": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+        "artifacts": artifacts,
+    }
+
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with tarfile.open(tmp, "w:gz") as tar:
+            data = json.dumps(manifest, indent=2).encode()
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+
+            for digest, blob in blobs.items():
+                tar.add(blob, arcname=f"blobs/{digest}")
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    logger.info(f"Bundle exported to {path}")
+    return path
+
+def import_bundle(path: Path) -> int:
+    """
+    Seed the artifact store from a bundle created by `export_bundle`. Every blob is verified against the manifest.
+
+    Arguments:
+        path: Path
+            The path to the archive.
+
+    Returns:
+        count: int
+            The number of imported artifacts.
+    """
+    store = ArtifactStore()
+    tmp_dir = store.root / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    with tarfile.open(path, "r:gz") as tar:
+        member = tar.next()
+        if member is None or member.name != "manifest.json":
+            raise ValueError(f"{path} is not a slash bundle.")
+
+        manifest = json.load(tar.extractfile(member))
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format: {manifest.get('format')}")
+
+        expected: Dict[str, List[dict]] = {}
+        for artifact in manifest["artifacts"]:
+            expected.setdefault(artifact["sha256"], []).append(artifact)
+
+        count = 0
+        while (member := tar.next()) is not None:
+            digest = Path(member.name).name
+            artifacts = expected.pop(digest, None)
+            if artifacts is None or not member.isfile():
+                continue
+
+            tmp = tmp_dir / f"import-{digest}"
+            with tar.extractfile(member) as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+            if tmp.stat().st_size != artifacts[0]["size"] or sha256sum(tmp) != digest:
+                tmp.unlink()
+                raise ValueError(f"Checksum mismatch for {', '.join(a['key'] for a in artifacts)}")
+
+            # the node may be offline, so the imported copies do not expire, e.g. the template config
+            blob = store.put(artifacts[0]["key"], tmp, mode=artifacts[0]["mode"], pinned=True)
+            for artifact in artifacts[1:]:
+                store.put(artifact["key"], store.link(blob, tmp), mode=artifact["mode"], pinned=True)
+            count += len(artifacts)
+
+    if expected:
+        missing = [artifact["key"] for artifacts in expected.values() for artifact in artifacts]
+        raise ValueError(f"The bundle is incomplete, missing: {', '.join(missing)}")
+
+    logger.info(f"Imported {count} artifacts (slash {manifest['version']}, created {manifest['created']}) from {path}")
+    return count
@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+import pickle
+from pathlib import Path
+from typing import IO, Any, Tuple, Type
+
+import slash.utils as utils
+
+
+ruamel_yaml = utils.lazy_import("ruamel.yaml")
+
+logger = utils.logger
+
+
+class Codec:
+    """
+    The interface of a config codec, which turns a config file into python objects and back.
+    """
+    # the name shown in logs and benchmarks
+    name: str = None
+
+    @property
+    def errors(self) -> Tuple[Type[Exception], ...]:
+        """
+        The exceptions raised when the input is malformed.
+        """
+        raise NotImplementedError
+
+    def load(self, stream: IO[str]) -> Any:
+        raise NotImplementedError
+
+    def dump(self, data: Any, stream: IO[str]) -> None:
+        raise NotImplementedError
+
+
+class YamlCodec(Codec):
+    """
+    A YAML codec backed by ruamel.yaml. The engine is created on first use, so that importing slash stays cheap.
+
+    Arguments:
+        typ: str
+            "safe" loads into plain dicts and lists, with the libyaml parser and emitter from ruamel.yaml.clib
+            when it is installed. Comments and formatting are dropped, which is fine for the generated configs.
+            "rt" (round-trip) keeps comments and formatting, for the files edited by humans. It is much slower.
+    """
+    def __init__(self, typ: str = "safe") -> None:
+        self.typ = typ
+        self.name = f"yaml-{typ}"
+        self._yaml = None
+
+    @property
+    def yaml(self) -> "ruamel_yaml.YAML":
+        if self._yaml is None:
+            yaml = ruamel_yaml.YAML(typ=self.typ, pure=False)
+            if self.typ == "safe":
+                # block style, like the round-trip dumper and mihomo itself
+                yaml.default_flow_style = False
+                yaml.width = 4096
+            self._yaml = yaml
+        return self._yaml
+
+    @property
+    def accelerated(self) -> bool:
+        """
+        Whether the libyaml parser is in use.
+        """
+        return self.yaml.Parser is not None and self.yaml.Parser.__module__.startswith("ruamel.yaml.clib")
+
+    @property
+    def errors(self) -> Tuple[Type[Exception], ...]:
+        return (ruamel_yaml.YAMLError,)
+
+    def load(self, stream: IO[str]) -> Any:
+        return self.yaml.load(stream)
+
+    def dump(self, data: Any, stream: IO[str]) -> None:
+        self.yaml.dump(data, stream)
+
+
+# the generated mihomo configs, which can be huge
+config_codec: Codec = YamlCodec("safe")
+# the configuration files edited by humans, e.g. .slashrc
+roundtrip_codec: Codec = YamlCodec("rt")
+
+
+class ConfigSnapshot:
+    """
+    A pickled copy of a parsed config file, stored next to it as ``.<name>.snapshot``, so that an unchanged
+    config is parsed once instead of on every load.
+
+    The snapshot records the codec, size, mtime and sha256 digest of the file it was taken from, and is only
+    used if all of them still match. A missing, stale or unreadable snapshot is simply taken again.
+
+    Arguments:
+        path: Path
+            The path to the config file.
+        codec: Codec
+            The codec to parse the config file with.
+    """
+    # bump when the layout of the snapshot changes
+    version = 1
+
+    def __init__(self, path: Path, codec: Codec) -> None:
+        self.path = path
+        self.codec = codec
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.path.with_name(f".{self.path.name}.snapshot")
+
+    def _header(self, data: bytes, st: os.stat_result) -> dict:
+        return {
+            "version": self.version,
+            "codec": self.codec.name,
+            "stamp": [st.st_size, st.st_mtime_ns],
+            "sha256": hashlib.sha256(data).hexdigest(),
+        }
+
+    def _read(self, data: bytes, st: os.stat_result) -> Tuple[bool, Any]:
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                # the header is pickled separately, so that a stale content is never unpickled
+                header = pickle.load(f)
+                if not isinstance(header, dict) or header.get("stamp") != [st.st_size, st.st_mtime_ns]:
+                    return False, None
+                if header != self._header(data, st):
+                    return False, None
+                return True, pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            # truncated, or written by another python
+            logger.debug(f"Ignore the unreadable snapshot {self.snapshot_path}: ({e.__class__.__name__}) {e}")
+            return False, None
+
+    def save(self, content: Any, data: bytes, st: os.stat_result) -> None:
+        """
+        Take a snapshot of the content parsed from data, the bytes of the config file whose stat is st.
+        A failure is not an error, the config is just parsed again next time.
+        """
+        tmp = self.snapshot_path.with_name(f"{self.snapshot_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(self._header(data, st), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.snapshot_path)
+        except (OSError, pickle.PicklingError) as e:
+            logger.debug(f"Failed to snapshot {self.path}: ({e.__class__.__name__}) {e}")
+            tmp.unlink(missing_ok=True)
+
+    def load(self) -> Any:
+        """
+        Load the config, from the snapshot if it is fresh. Otherwise parse the file and take a new snapshot.
+        Raise FileNotFoundError if the file is missing, or one of the codec errors if it is malformed.
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+            st = os.fstat(f.fileno())
+
+        hit, content = self._read(data, st)
+        if hit:
+            return content
+
+        content = self.codec.load(io.StringIO(data.decode()))
+        self.save(content, data, st)
+        return content
+
+    def dump(self, content: Any) -> None:
+        """
+        Write the config atomically, and take a snapshot of it on the way.
+        """
+        stream = io.StringIO()
+        self.codec.dump(content, stream)
+        data = stream.getvalue().encode()
+
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        st = tmp.stat()
+        os.replace(tmp, self.path)
+        self.save(content, data, st)
@@ -1,15 +1,16 @@
 from dataclasses import dataclass, field
 from typing import Any, Optional
 
-from filelock import SoftFileLock
-from ruamel.yaml import YAML
-
 import slash.utils as utils
+from slash.core.codec import roundtrip_codec
 from slash.core.constants import CONFIG_PATH
 
 
+filelock = utils.lazy_import("filelock")
+
 logger = utils.logger
-yaml = YAML()
+# keep the comments and formatting of .slashrc
+codec = roundtrip_codec
 
 @dataclass
 class SlashConfig:
@@ -26,10 +27,37 @@ class SlashConfig:
             "serializer": lambda x: int(x)
         }
     )
+    release_cache_ttl: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "Cache the latest GitHub releases for this many seconds. Default is 6 hours.",
+            "serializer": lambda x: int(x)
+        }
+    )
+    template_cache_ttl: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "Download the template config of the conversion again after this many seconds. Default is 1 day.",
+            "serializer": lambda x: int(x)
+        }
+    )
+    converter: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "The converter of the subscriptions: builtin (default), or subconverter with the ACL4SSR rules. The builtin one falls back to subconverter."
+        }
+    )
+    subconverter_server: Optional[bool] = field(
+        default=None,
+        metadata={
+            "help": "Convert the subscriptions with a shared subconverter server, which is started on demand and stops when idle.",
+            "serializer": lambda x: x.lower() in ("true", "yes", "on", "1")
+        }
+    )
 
 class ConfigManager:
     def __init__(self):
-        self._lock = SoftFileLock(CONFIG_PATH.with_suffix(".lock"))
+        self._lock = filelock.SoftFileLock(CONFIG_PATH.with_suffix(".lock"))
         if not CONFIG_PATH.exists():
             logger.debug(f"Creating a new configuration file at {CONFIG_PATH}")
             CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -37,13 +65,13 @@ class ConfigManager:
 
     def load(self) -> dict:
         with open(CONFIG_PATH, "r") as f:
-            content = yaml.load(f)
+            content = codec.load(f)
 
         return content
 
     def save(self, config: dict) -> None:
         with open(CONFIG_PATH, "w") as f:
-            yaml.dump(config, f)
+            codec.dump(config, f)
 
     def get_config(self) -> SlashConfig:
         with self._lock:
@@ -0,0 +1,323 @@
+import base64
+import binascii
+import io
+import itertools
+import json
+import re
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterator, List, Optional, Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import slash.utils as utils
+from slash.core.codec import ConfigSnapshot, config_codec
+
+
+logger = utils.logger
+
+# read the subscription in chunks of this size (bytes)
+CHUNK_SIZE = 1 << 16
+
+# the proxy-groups and rules of the converted config; "{proxies}" stands for the names of all proxies
+TEMPLATE = {
+    "mode": "rule",
+    "log-level": "info",
+    "allow-lan": False,
+    "proxy-groups": [
+        {"name": "Select", "type": "select", "proxies": ["Auto", "DIRECT", "{proxies}"]},
+        {
+            "name": "Auto", "type": "url-test", "proxies": ["{proxies}"],
+            "url": "http://www.gstatic.com/generate_204", "interval": 300, "tolerance": 50,
+        },
+    ],
+    "rules": [
+        "DOMAIN-SUFFIX,local,DIRECT",
+        "IP-CIDR,127.0.0.0/8,DIRECT,no-resolve",
+        "IP-CIDR,10.0.0.0/8,DIRECT,no-resolve",
+        "IP-CIDR,172.16.0.0/12,DIRECT,no-resolve",
+        "IP-CIDR,192.168.0.0/16,DIRECT,no-resolve",
+        "IP-CIDR,100.64.0.0/10,DIRECT,no-resolve",
+        "IP-CIDR6,::1/128,DIRECT,no-resolve",
+        "IP-CIDR6,fc00::/7,DIRECT,no-resolve",
+        "GEOIP,CN,DIRECT",
+        "MATCH,Select",
+    ],
+}
+
+
+def b64decode(data: str) -> bytes:
+    """
+    Decode base64, either standard or url-safe, with or without padding.
+    """
+    data = re.sub(r"\s+", "", data).replace("-", "+").replace("_", "/")
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+def _params(query: str) -> Dict[str, str]:
+    return {key: values[0] for key, values in parse_qs(query).items()}
+
+def _flag(value: Optional[str]) -> bool:
+    return value is not None and value.lower() in ("1", "true")
+
+def _transport(proxy: dict, network: str, host: str = "", path: str = "", service_name: str = "") -> dict:
+    """
+    Set the transport options of a proxy.
+    """
+    if network in ("", "tcp", "none"):
+        return proxy
+
+    proxy["network"] = network
+    if network == "ws":
+        proxy["ws-opts"] = {"path": path or "/"}
+        if host:
+            proxy["ws-opts"]["headers"] = {"Host": host}
+    elif network == "grpc":
+        proxy["grpc-opts"] = {"grpc-service-name": service_name or path}
+    elif network == "h2":
+        proxy["h2-opts"] = {"path": path or "/"}
+        if host:
+            proxy["h2-opts"]["host"] = host.split(",")
+    elif network == "http":
+        proxy["http-opts"] = {"path": [path or "/"]}
+        if host:
+            proxy["http-opts"]["headers"] = {"Host": host.split(",")}
+    return proxy
+
+def parse_ss(uri: str) -> dict:
+    url = urlsplit(uri)
+    if "@" in url.netloc:
+        # SIP002: ss://base64(method:password)@host:port?plugin=...#name
+        userinfo, _, address = url.netloc.rpartition("@")
+        userinfo = unquote(userinfo)
+        if ":" not in userinfo:
+            userinfo = b64decode(userinfo).decode()
+    else:
+        # legacy: ss://base64(method:password@host:port)#name
+        userinfo, _, address = b64decode(unquote(url.netloc)).decode().rpartition("@")
+    cipher, _, password = userinfo.partition(":")
+    server, _, port = address.rpartition(":")
+
+    proxy = {
+        "name": unquote(url.fragment), "type": "ss", "server": server.strip("[]"), "port": int(port),
+        "cipher": cipher, "password": password, "udp": True,
+    }
+    plugin = _params(url.query).get("plugin")
+    if plugin:
+        name, *options = plugin.split(";")
+        opts = dict(option.partition("=")[::2] for option in options)
+        if name in ("obfs-local", "simple-obfs"):
+            proxy["plugin"] = "obfs"
+            proxy["plugin-opts"] = {"mode": opts.get("obfs", "http"), "host": opts.get("obfs-host", "")}
+        elif name == "v2ray-plugin":
+            proxy["plugin"] = "v2ray-plugin"
+            proxy["plugin-opts"] = {
+                "mode": opts.get("mode", "websocket"), "host": opts.get("host", ""), "path": opts.get("path", "/"),
+                "tls": "tls" in opts,
+            }
+        else:
+            raise ValueError(f"Unsupported plugin: {name}")
+    return proxy
+
+def parse_ssr(uri: str) -> dict:
+    # ssr://base64(host:port:protocol:method:obfs:base64(password)/?obfsparam=...&protoparam=...&remarks=...)
+    main, _, query = b64decode(uri[len("ssr://"):]).decode().partition("/?")
+    server, port, protocol, cipher, obfs, password = main.rsplit(":", 5)
+    params = _params(query)
+
+    def param(key: str) -> str:
+        return b64decode(params[key]).decode() if params.get(key) else ""
+
+    return {
+        "name": param("remarks"), "type": "ssr", "server": server.strip("[]"), "port": int(port),
+        "cipher": cipher, "password": b64decode(password).decode(), "protocol": protocol, "obfs": obfs,
+        "protocol-param": param("protoparam"), "obfs-param": param("obfsparam"), "udp": True,
+    }
+
+def parse_vmess(uri: str) -> dict:
+    # vmess://base64(json), the format of v2rayN
+    data = json.loads(b64decode(uri[len("vmess://"):]))
+    proxy = {
+        "name": str(data.get("ps", "")), "type": "vmess", "server": data["add"], "port": int(data["port"]),
+        "uuid": data["id"], "alterId": int(data.get("aid") or 0), "cipher": data.get("scy") or "auto", "udp": True,
+    }
+    if data.get("tls") == "tls":
+        proxy["tls"] = True
+        if data.get("sni"):
+            proxy["servername"] = data["sni"]
+        if data.get("fp"):
+            proxy["client-fingerprint"] = data["fp"]
+    network = data.get("net", "tcp")
+    if network == "tcp" and data.get("type") == "http":
+        network = "http"
+    return _transport(proxy, network, data.get("host", ""), data.get("path", ""), data.get("path", ""))
+
+def parse_vless(uri: str) -> dict:
+    url = urlsplit(uri)
+    params = _params(url.query)
+    proxy = {
+        "name": unquote(url.fragment), "type": "vless", "server": url.hostname, "port": url.port,
+        "uuid": unquote(url.username), "udp": True,
+    }
+    if params.get("flow"):
+        proxy["flow"] = params["flow"]
+    if params.get("security") in ("tls", "reality"):
+        proxy["tls"] = True
+        if params.get("sni"):
+            proxy["servername"] = params["sni"]
+        if params.get("fp"):
+            proxy["client-fingerprint"] = params["fp"]
+        if params["security"] == "reality":
+            proxy["reality-opts"] = {"public-key": params.get("pbk", ""), "short-id": params.get("sid", "")}
+    return _transport(proxy, params.get("type", "tcp"), params.get("host", ""), params.get("path", ""), params.get("serviceName", ""))
+
+def parse_trojan(uri: str) -> dict:
+    url = urlsplit(uri)
+    params = _params(url.query)
+    proxy = {
+        "name": unquote(url.fragment), "type": "trojan", "server": url.hostname, "port": url.port,
+        "password": unquote(url.username), "udp": True,
+    }
+    if params.get("sni") or params.get("peer"):
+        proxy["sni"] = params.get("sni") or params["peer"]
+    if _flag(params.get("allowInsecure")):
+        proxy["skip-cert-verify"] = True
+    return _transport(proxy, params.get("type", "tcp"), params.get("host", ""), params.get("path", ""), params.get("serviceName", ""))
+
+def parse_hysteria2(uri: str) -> dict:
+    url = urlsplit(uri)
+    params = _params(url.query)
+    proxy = {
+        "name": unquote(url.fragment), "type": "hysteria2", "server": url.hostname, "port": url.port or 443,
+        "password": unquote(url.netloc.rpartition("@")[0]),
+    }
+    if params.get("sni"):
+        proxy["sni"] = params["sni"]
+    if params.get("obfs"):
+        proxy["obfs"] = params["obfs"]
+        proxy["obfs-password"] = params.get("obfs-password", "")
+    if _flag(params.get("insecure")):
+        proxy["skip-cert-verify"] = True
+    return proxy
+
+# the parsers of the share links, by scheme
+PARSERS: Dict[str, Callable[[str], dict]] = {
+    "ss": parse_ss,
+    "ssr": parse_ssr,
+    "vmess": parse_vmess,
+    "vless": parse_vless,
+    "trojan": parse_trojan,
+    "hysteria2": parse_hysteria2,
+    "hy2": parse_hysteria2,
+}
+
+def parse_uri(uri: str) -> dict:
+    """
+    Parse a share link into a mihomo proxy. Raise a ValueError if the link is not supported or malformed.
+    """
+    scheme = uri.partition("://")[0].lower()
+    if scheme not in PARSERS:
+        raise ValueError(f"Unsupported scheme: {scheme}")
+    try:
+        proxy = PARSERS[scheme](uri)
+    except (KeyError, TypeError, ValueError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"Malformed {scheme} link: {e}") from e
+    if not proxy["server"] or not proxy["port"]:
+        raise ValueError(f"Malformed {scheme} link: no server")
+    proxy["name"] = proxy["name"] or f"{proxy['server']}:{proxy['port']}"
+    return proxy
+
+
+def _lines(chunks: Iterator[bytes]) -> Iterator[str]:
+    buffer = b""
+    for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            yield line.decode(errors="replace").strip()
+    yield buffer.decode(errors="replace").strip()
+
+def _b64_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Decode a base64 stream, 4 characters at a time.
+    """
+    buffer = b""
+    for chunk in chunks:
+        buffer += re.sub(rb"\s+", b"", chunk)
+        size = len(buffer) - len(buffer) % 4
+        if size:
+            yield b64decode(buffer[:size].decode())
+            buffer = buffer[size:]
+    if buffer.rstrip(b"="):
+        yield b64decode(buffer.decode())
+
+def iter_proxies(f: IO[bytes]) -> Iterator[dict]:
+    """
+    Parse the proxies of a subscription: a base64 encoded or plain list of share links, or a clash config.
+    The share links are decoded and parsed chunk by chunk, so the raw subscription is never read as a whole.
+    Raise a ValueError on the first unsupported link, rather than dropping its proxy.
+    """
+    head = f.read(CHUNK_SIZE)
+    chunks = itertools.chain([head], iter(lambda: f.read(CHUNK_SIZE), b""))
+    text = head.lstrip(b"\xef\xbb\xbf").strip()
+
+    if re.fullmatch(rb"[A-Za-z0-9+/=_\-\s]+", text):
+        lines = _lines(_b64_chunks(chunks))
+    elif re.match(rb"^[A-Za-z0-9]+://", text):
+        lines = _lines(chunks)
+    else:
+        # a clash config, only its proxies are kept
+        config = config_codec.load(io.StringIO(b"".join(chunks).decode()))
+        if not isinstance(config, dict) or not isinstance(config.get("proxies"), list):
+            raise ValueError("The subscription is neither a list of share links nor a clash config.")
+        yield from config["proxies"]
+        return
+
+    for line in lines:
+        if line:
+            yield parse_uri(line)
+
+def build_config(proxies: List[dict]) -> dict:
+    """
+    Build a mihomo config from the proxies and the template. The proxy names are made unique.
+    """
+    names = set()
+    for proxy in proxies:
+        name, i = proxy["name"], 1
+        while name in names:
+            i += 1
+            name = f"{proxy['name']} {i}"
+        proxy["name"] = name
+        names.add(name)
+
+    def expand(members: List[str]) -> List[str]:
+        return [name for member in members for name in ([proxy["name"] for proxy in proxies] if member == "{proxies}" else [member])]
+
+    config = {key: value for key, value in TEMPLATE.items() if key not in ("proxy-groups", "rules")}
+    config["proxies"] = proxies
+    config["proxy-groups"] = [dict(group, proxies=expand(group["proxies"])) for group in TEMPLATE["proxy-groups"]]
+    config["rules"] = list(TEMPLATE["rules"])
+    return config
+
+def convert(sub: Union[str, Path], tgt: Path) -> Path:
+    """
+    Convert a subscription file to a mihomo config, in process. The config lists every proxy, so all the
+    proxies are kept in memory until it is written.
+
+    Raise a ValueError if any share link is not supported, rather than dropping its proxy, so that the caller
+    can fall back to subconverter.
+
+    Arguments:
+        sub: Union[str, Path]
+            The path to the subscription file.
+        tgt: Path
+            The target path to save the config. A snapshot of it is taken as well, see `ConfigSnapshot`.
+
+    Returns:
+        tgt: Path
+            The target path.
+    """
+    with open(sub, "rb") as f:
+        proxies = list(iter_proxies(f))
+    if not proxies:
+        raise ValueError("No proxies found in the subscription.")
+
+    ConfigSnapshot(Path(tgt), config_codec).dump(build_config(proxies))
+    logger.info(f"Converted {len(proxies)} proxies.")
+    return Path(tgt)
@@ -1,27 +1,406 @@
+import hashlib
 import json
+import os
 import secrets
 import shutil
+import socket
 import subprocess
 import sys
 import tarfile
 import tempfile
 import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Union
-
-from ruamel.yaml import YAML, YAMLError
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import slash.utils as utils
-from slash.core.config import SlashConfig
-from slash.core.constants import ENVS_DIR, WORK_DIR
+from slash.core import constants, converter
+from slash.core.codec import Codec, ConfigSnapshot, config_codec
+from slash.core.config import ConfigManager, SlashConfig
+from slash.core.constants import ENVS_DIR
+from slash.core.store import ArtifactStore, sha256sum
+
 
+filelock = utils.lazy_import("filelock")
+psutil = utils.lazy_import("psutil")
+requests = utils.lazy_import("requests")
 
 logger = utils.logger
-yaml = YAML()
+
+# download the template config again after this many seconds, unless template_cache_ttl is set
+TEMPLATE_CACHE_TTL = 24 * 60 * 60
+
+def release_cache_ttl() -> Optional[int]:
+    """
+    The time to live of the cached GitHub releases, from the Slash config.
+    """
+    return ConfigManager().get_config().release_cache_ttl
+
+def template_cache_ttl() -> int:
+    """
+    The time to live of the cached template config, from the Slash config.
+    """
+    ttl = ConfigManager().get_config().template_cache_ttl
+    return TEMPLATE_CACHE_TTL if ttl is None else ttl
+
+SUBCONVERTER_KEY = "https://github.com/MetaCubeX/subconverter/releases/latest/download/subconverter_linux64.tar.gz"
+TEMPLATE_KEY = "https://raw.githubusercontent.com/zsokami/ACL4SSR/main/ACL4SSR_Online_Mannix.ini"
+GEOIP_KEY = "https://github.com/MetaCubeX/meta-rules-dat/releases/download/latest/geoip.metadb"
+
+# the options of every conversion, as in generate.ini of subconverter and the query of its /sub api
+CONVERT_OPTIONS = {
+    "target": "clash",
+    "insert": "false",
+    "new_name": "true",
+    "emoji": "true",
+    "list": "false",
+    "tfo": "false",
+    "scv": "true",
+    "fdn": "false",
+    "expand": "true",
+    "sort": "false",
+}
+TEMPLATE_NAME = "ACL4SSR_Online_Mannix.ini"
+
+def get_subconverter_tarball() -> Path:
+    """
+    Return the path to the subconverter tarball in the artifact store. Download if not found.
+    """
+    store = ArtifactStore()
+
+    if store.get(SUBCONVERTER_KEY) is None: # download and cache
+        logger.info("Preparing subconverter. Please wait, it could take a few minutes...")
+
+    # Use the release
+    return store.fetch(
+        key = SUBCONVERTER_KEY,
+        urls = lambda: [
+            url for url in [
+                utils.get_latest_github_release("MetaCubeX/subconverter", "subconverter_linux64.tar.gz", ttl=release_cache_ttl()),
+                SUBCONVERTER_KEY,
+            ]
+            if url is not None
+        ],
+        desc = "Downloading subconverter tarball..."
+    )
+
+def get_template() -> Path:
+    """
+    Return the path to the template config file in the artifact store.
+    It is downloaded again once it is older than the template TTL; the stored one is used if the download fails.
+    """
+    return ArtifactStore().fetch(
+        key = TEMPLATE_KEY,
+        urls = TEMPLATE_KEY,
+        desc = "Downloading template config file...",
+        max_age = template_cache_ttl(),
+        stale_if_error = True,
+    )
+
+def get_subconverter_dir() -> Path:
+    """
+    Return the directory of the subconverter executable, extracted from the tarball in the artifact store.
+
+    The tarball is extracted once, into ``WORK_DIR/subconverter/<sha256 of the tarball>``, so a new tarball gets
+    a new tree. The trees of the older tarballs are removed.
+    """
+    tarball = get_subconverter_tarball()
+    root = constants.WORK_DIR / "subconverter"
+    target = root / tarball.name
+    work_dir = target / "subconverter"
+    if (work_dir / "subconverter").exists():
+        return work_dir
+
+    root.mkdir(parents=True, exist_ok=True)
+    with filelock.SoftFileLock(root / ".lock"):
+        if not (work_dir / "subconverter").exists():
+            # extract aside, then move in place, so that the tree is never seen half-extracted
+            tmp = Path(tempfile.mkdtemp(prefix=".extract-", dir=root))
+            try:
+                with tarfile.open(tarball, "r:gz") as tar:
+                    tar.extractall(tmp, filter=lambda *args: args[0])
+
+                # check if the executable exists
+                if not (tmp / "subconverter" / "subconverter").exists():
+                    raise FileNotFoundError("Subconverter executable not found.")
+
+                shutil.rmtree(target, ignore_errors=True)
+                os.replace(tmp, target)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+            for path in root.iterdir():
+                if path.name != target.name and not path.name.startswith("."):
+                    shutil.rmtree(path, ignore_errors=True)
+
+    return work_dir
+
+def get_geoip() -> Path:
+    """
+    Return the path to geoip.metadb in the artifact store. Download if not found.
+    """
+    return ArtifactStore().fetch(
+        key = GEOIP_KEY,
+        urls = lambda: [
+            url for url in [
+                utils.get_latest_github_release("MetaCubeX/meta-rules-dat", "geoip.metadb", ttl=release_cache_ttl()),
+                GEOIP_KEY,
+                "https://github.com/MetaCubeX/meta-rules-dat/blob/release/geoip.metadb",
+            ]
+            if url is not None
+        ],
+        desc = "Downloading geoip.metadb...",
+        segments = 4,
+    )
+
+def link_subconverter_dir(work_dir: Path, exclude: Tuple[str, ...] = ()) -> None:
+    """
+    Fill work_dir with symlinks to the extracted subconverter tree, except the excluded names, which the caller
+    writes itself. subconverter changes to the directory of the path it is run by, i.e. work_dir, so the shared
+    tree is never written to.
+    """
+    for path in get_subconverter_dir().iterdir():
+        if path.name not in exclude:
+            (work_dir / path.name).symlink_to(path)
+
+def patch_ini(text: str, section: str, values: Dict[str, str]) -> str:
+    """
+    Set the values of the keys in a section of an ini file, keeping everything else as it is.
+    """
+    lines = text.splitlines()
+    start = next((i for i, line in enumerate(lines) if line.strip() == f"[{section}]"), None)
+    if start is None:
+        lines.append(f"[{section}]")
+        start = len(lines) - 1
+
+    end = next((i for i in range(start + 1, len(lines)) if lines[i].lstrip().startswith("[")), len(lines))
+    missing = dict(values)
+    for i in range(start + 1, end):
+        key = lines[i].split("=", 1)[0].strip()
+        if "=" in lines[i] and not lines[i].lstrip().startswith((";", "#")) and key in missing:
+            lines[i] = f"{key}={missing.pop(key)}"
+    lines[start + 1:start + 1] = [f"{key}={value}" for key, value in missing.items()]
+    return "\n".join(lines) + "\n"
+
+
+class SubconverterServer:
+    """
+    A local subconverter running in its HTTP server mode, shared by the conversions of every process.
+
+    It is started on first use by a small supervisor process, listens on a free port of 127.0.0.1, and is shut
+    down by the supervisor after `idle_timeout` seconds without conversions. Each conversion touches the state
+    file, whose mtime is the time of the last use.
+
+    The server runs in the api mode, where reading local files needs the access token. The token is random
+    for each server and only kept in files readable by the user, so other users of the host cannot use the
+    server to read our files.
+
+    WORK_DIR may be shared by the nodes of a cluster, so each host has its own server and state. A process is
+    only taken for the server if its pid and its create time both match the state, since the pid may have been
+    reused, e.g. after a reboot.
+
+    Layout::
+
+        WORK_DIR/subconverter/.server/
+            <hostname>/         the working directory: symlinks to the extracted tree, and the patched pref.ini
+            <hostname>.json     the pids and create times of the supervisor and of subconverter, the port,
+                                the token and the tarball digest
+            <hostname>.lock
+    """
+    # shut down after this many seconds without conversions
+    idle_timeout = 10 * 60
+    # check whether the server is idle this often (seconds)
+    interval = 10
+    # wait this many seconds for the server to start
+    startup_timeout = 30
+
+    @property
+    def root(self) -> Path:
+        return constants.WORK_DIR / "subconverter" / ".server"
+
+    @property
+    def workdir(self) -> Path:
+        return self.root / socket.gethostname()
+
+    @property
+    def state_path(self) -> Path:
+        return self.root / f"{socket.gethostname()}.json"
+
+    def _read(self) -> dict:
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def _process(pid: Optional[int], created: Optional[float]) -> Optional["psutil.Process"]:
+        """
+        Get the process of the pid, if it is the one created at the given time.
+        """
+        if pid is None or created is None:
+            return None
+        try:
+            proc = utils.get_process(pid)
+            return proc if proc is not None and proc.create_time() == created else None
+        except psutil.Error:
+            return None
+
+    def load(self) -> Optional[dict]:
+        """
+        Load the state of the running server, or None if it is not running.
+        """
+        state = self._read()
+        if not all(self._process(state.get(key), state.get(f"{key}_created")) for key in ["pid", "server_pid"]):
+            return None
+        return state
+
+    @staticmethod
+    def _write_private(path: Path, text: str) -> None:
+        """
+        Write a file atomically, readable by the user only.
+        """
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def launch_command(self) -> List[str]:
+        return [sys.executable, "-c", "from slash.core.envs import SubconverterServer; SubconverterServer().serve()"]
+
+    def spawn(self) -> None:
+        utils.runbg(self.launch_command())
+
+    def address(self) -> Tuple[str, str]:
+        """
+        Get the address and the access token of the server. Start it if it is not running, or runs an older
+        subconverter. Raise a RuntimeError if it fails to start.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        with filelock.SoftFileLock(self.state_path.with_suffix(".lock")):
+            state = self.load()
+            if state is None or state["digest"] != get_subconverter_dir().parent.name or "token" not in state:
+                self.stop()
+                self.spawn()
+
+                deadline = time.time() + self.startup_timeout
+                while (state := self.load()) is None:
+                    if time.time() > deadline:
+                        raise RuntimeError("The subconverter server failed to start.")
+                    time.sleep(0.1)
+
+            # mark the server as used
+            os.utime(self.state_path)
+        return f"http://127.0.0.1:{state['port']}", state["token"]
+
+    def stop(self) -> None:
+        """
+        Stop the server, if it is running.
+        """
+        # either process may be left alone; a pid that is not our process any more is never signalled
+        state = self._read()
+        for key in ["pid", "server_pid"]:
+            proc = self._process(state.get(key), state.get(f"{key}_created"))
+            if proc is not None:
+                try:
+                    proc.terminate()
+                except (psutil.Error, OSError):
+                    pass
+        self.state_path.unlink(missing_ok=True)
+
+    def serve(self) -> None:
+        """
+        Run subconverter, then wait until it is idle and shut it down. This is the supervisor process.
+        """
+        work_dir = get_subconverter_dir()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        self.workdir.mkdir(parents=True)
+        link_subconverter_dir(self.workdir, exclude=("pref.ini",))
+
+        # our own pref.ini, based on the shipped one, which listens on a free port
+        token = secrets.token_urlsafe(32)
+        with utils.FreePort() as free_port:
+            port = free_port.port
+            for name in ["pref.ini", "pref.example.ini"]:
+                if (work_dir / name).exists():
+                    pref = (work_dir / name).read_text()
+                    break
+            else:
+                pref = ""
+            pref = patch_ini(pref, "server", {"listen": "127.0.0.1", "port": str(port)})
+            # in the api mode, local files are only accepted with the access token
+            pref = patch_ini(pref, "common", {"api_mode": "true", "api_access_token": token})
+            self._write_private(self.workdir / "pref.ini", pref)
+
+            with open(self.workdir / "server.log", "w") as log:
+                process = subprocess.Popen(
+                    [str(self.workdir / "subconverter"), "-f", "pref.ini"],
+                    cwd=self.workdir, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+                )
+
+        try:
+            url = f"http://127.0.0.1:{port}/version"
+            deadline = time.time() + self.startup_timeout
+            while True:
+                if process.poll() is not None or time.time() > deadline:
+                    return
+                try:
+                    if utils.get_session("local").get(url, timeout=1).ok:
+                        break
+                except requests.exceptions.RequestException:
+                    pass
+                time.sleep(0.1)
+
+            state = {
+                "pid": os.getpid(), "pid_created": utils.get_process().create_time(),
+                "server_pid": process.pid, "server_pid_created": utils.get_process(process.pid).create_time(),
+                "port": port, "token": token, "digest": work_dir.parent.name,
+            }
+            self._write_private(self.state_path, json.dumps(state))
+
+            while process.poll() is None:
+                time.sleep(self.interval)
+                try:
+                    if time.time() - self.state_path.stat().st_mtime > self.idle_timeout:
+                        break
+                except FileNotFoundError:
+                    break # stopped
+        finally:
+            if self._read().get("pid") == os.getpid():
+                self.state_path.unlink(missing_ok=True)
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def convert(self, sub: Union[str, Path], tgt: Path) -> Path:
+        """
+        Convert the subscription with the server. See `convert`.
+        """
+        address, token = self.address()
+        tpl_config = self.workdir / TEMPLATE_NAME
+        ArtifactStore().link(get_template(), tpl_config)
+
+        params = {**CONVERT_OPTIONS, "config": str(tpl_config), "url": str(sub), "token": token}
+        response = utils.get_session("local").get(f"{address}/sub", params=params, timeout=(5, 600))
+        if response.status_code != 200:
+            raise ValueError("Failed to convert the subscription: %s" % response.text.strip())
+
+        tmp = tgt.with_name(f".{tgt.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp, tgt)
+        return tgt
+
 
 def convert(sub: Union[str, Path], tgt: Path) -> Path:
     """
     Convert the subscription to a config file.
+    A subscription file is converted in process by `slash.core.converter`, unless the `converter` option is
+    "subconverter". subconverter is the fallback: with the `subconverter_server` option, the conversion is done
+    by the shared `SubconverterServer`, otherwise by running subconverter once.
 
     Arguments:
         sub: str
@@ -29,69 +408,38 @@ def convert(sub: Union[str, Path], tgt: Path) -> Path:
         tgt: Path
             The target path to save the converted subscription.
     """
+    config = ConfigManager().get_config()
+    if config.converter != "subconverter" and Path(sub).is_file():
+        try:
+            return converter.convert(sub, tgt)
+        except (ValueError, *converter.config_codec.errors) as e:
+            logger.warn(f"Failed to convert the subscription in process, use subconverter instead: {e}")
 
-    # prepare subconverter
-    tar_path = WORK_DIR / "subconverter.tar.gz"
-
-    if not tar_path.exists(): # download and cache
-
-        logger.info("Preparing subconverter. Please wait, it could take a few minutes...")
-        WORK_DIR.mkdir(parents=True, exist_ok=True)
+    if config.subconverter_server:
+        try:
+            return SubconverterServer().convert(sub, tgt)
+        except Exception as e:
+            logger.warn(f"The subconverter server failed, run subconverter instead: ({e.__class__.__name__}) {e}")
 
-        # Use the release
-        utils.download_file(
-            urls = utils.get_latest_github_release("MetaCubeX/subconverter", "subconverter_linux64.tar.gz"),
-            path = tar_path,
-            desc = "Downloading subconverter tarball..."
-        )
+    # prepare subconverter
+    template = get_template()
 
     # process in the temp directory
     with tempfile.TemporaryDirectory() as tmpdir:
 
-        tpl_config = Path(tmpdir) / "ACL4SSR_Online_Mannix.ini"
-
-        # download the latest config file
-        utils.download_file(
-            urls = "https://raw.githubusercontent.com/zsokami/ACL4SSR/main/ACL4SSR_Online_Mannix.ini",
-            path = tpl_config,
-            desc = "Downloading template config file..."
-        )
-
-        # extract the tarball
-        with tarfile.open(tar_path, "r:gz") as tar:
-            tar.extractall(tmpdir, filter=lambda *args: args[0])
-
-        # find the executable
-        work_dir = Path(tmpdir) / "subconverter"
+        # the scratch space of this conversion, only generate.ini and the output are written
+        work_dir = Path(tmpdir)
+        link_subconverter_dir(work_dir, exclude=("generate.ini", "output.yaml"))
         executable = work_dir / "subconverter"
 
-        # check if the executable exists
-        if not executable.exists():
-            raise FileNotFoundError("Subconverter executable not found.")
+        tpl_config = work_dir / TEMPLATE_NAME
+        ArtifactStore().link(template, tpl_config)
 
         # setup the config
-        config = work_dir / "generate.ini"
-        with open(config, "w") as f:
-            f.write(
-                utils.dals(
-                    """
-                    [test]
-                    path=output.yaml
-                    target=clash
-                    insert=false
-                    new_name=true
-                    emoji=true
-                    list=false
-                    tfo=false
-                    scv=true
-                    fdn=false
-                    expand=true
-                    sort=false
-                    config=%(tpl_config)s
-                    url=%(sub)s
-                    """ % {"sub": str(sub), "tpl_config": str(tpl_config)}
-                )
-            )
+        options = {**CONVERT_OPTIONS, "config": str(tpl_config), "url": str(sub)}
+        with open(work_dir / "generate.ini", "w") as f:
+            f.write("[test]\npath=output.yaml\n")
+            f.writelines(f"{key}={value}\n" for key, value in options.items())
 
         # run the executable
         result = subprocess.run([str(executable), "-g"], cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -105,7 +453,125 @@ def convert(sub: Union[str, Path], tgt: Path) -> Path:
 
     return tgt
 
+class SubscriptionCache:
+    """
+    The subscriptions fetched and converted once for every environment with the same source.
+
+    An entry is keyed by the normalized subscription urls and the conversion parameters. The environments
+    hardlink its config (and the snapshot of it), so a refresh by one environment is available to the others
+    without a download or a conversion. The entry is not checked again within `max_age` seconds, so the
+    environments updated together, e.g. by `slash env update --all`, share one request.
+
+    Layout::
+
+        subscriptions/<key>/
+            subscription        the raw subscription
+            config.yaml         the converted config, and its snapshot
+            state.json          the validators of the response, the sha256 digest of the subscription, the check time
+    """
+    # do not check the subscription again within this many seconds
+    max_age = 60
+
+    def __init__(self, subscriptions: List[str]) -> None:
+        self.subscriptions = subscriptions
+
+    @staticmethod
+    def normalize(url: str) -> str:
+        """
+        Normalize a url: lower-case the scheme and host, drop the default port and the fragment, sort the query.
+        """
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.rpartition("@")
+        host = netloc[2].lower()
+        if (scheme, host.rpartition(":")[2]) in [("http", "80"), ("https", "443")]:
+            host = host.rpartition(":")[0]
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((scheme, netloc[0] + netloc[1] + host, parts.path or "/", query, ""))
+
+    @property
+    def key(self) -> str:
+        params = {"converter": ConfigManager().get_config().converter or "builtin", **CONVERT_OPTIONS}
+        source = json.dumps([[self.normalize(url) for url in self.subscriptions], params], sort_keys=True)
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    @property
+    def path(self) -> Path:
+        return constants.WORK_DIR / "subscriptions" / self.key
+
+    @property
+    def config_path(self) -> Path:
+        return self.path / "config.yaml"
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.path / "state.json", "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self, state: dict) -> None:
+        tmp = self.path / f".state.json.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path / "state.json")
+
+    def refresh(self) -> dict:
+        """
+        Download the subscription if it is modified, and convert it if its content changed. A subscription
+        that is a local file is read from the file instead.
+
+        Returns:
+            state: dict
+                The state of the entry, with the sha256 digest of the subscription that config.yaml was converted from.
+        """
+        path = self.path
+        path.mkdir(parents=True, exist_ok=True)
+        with filelock.SoftFileLock(path / ".lock"):
+            state = self._load_state()
+            cached = self.config_path.exists() and "sha256" in state
+            if cached and time.time() - state.get("time", 0) < self.max_age:
+                return state
+
+            # download_file skips an existing file, so a download left by a failed refresh must not survive
+            tmp = path / "subscription.tmp"
+            tmp.unlink(missing_ok=True)
+            try:
+                local = next((Path(url) for url in self.subscriptions if Path(url).is_file()), None)
+                if local is not None:
+                    # a local subscription or config file, e.g. on an offline node
+                    shutil.copyfile(local, tmp)
+                    validators = {"url": str(local), "etag": None, "last_modified": None}
+                else:
+                    validators = utils.download_file(
+                        urls = self.subscriptions,
+                        path = tmp,
+                        desc = "Downloading subscription...",
+                        validators = state if cached else None,
+                    )
+
+                if validators is not None:
+                    digest = sha256sum(tmp)
+                    if cached and digest == state["sha256"]:
+                        logger.info("The subscription is not changed.")
+                    else:
+                        # convert the subscription, and parse the result once for all the envs
+                        convert(tmp, self.config_path)
+                        ConfigSnapshot(self.config_path, config_codec).load()
+                    os.replace(tmp, path / "subscription")
+                    state = {**validators, "sha256": digest}
+            finally:
+                tmp.unlink(missing_ok=True)
+
+            state["time"] = time.time()
+            self._save_state(state)
+            return state
+
+
 class Env:
+    # the codec of config.yaml
+    codec: Codec = config_codec
+
     def __init__(
         self,
         name: str,
@@ -126,6 +592,8 @@ class Env:
         self.name = name
         self.subscriptions = subscriptions
         self.last_updated = last_updated
+        # the config being edited in `edit_config`
+        self._config: Optional[dict] = None
 
     @property
     def workdir(self) -> Path:
@@ -143,10 +611,12 @@ class Env:
 
     def save_to(self, path: Path) -> None:
         """
-        Save as a json file.
+        Save as a json file. The file is replaced atomically, so that a new inode tells the registry it changed.
         """
-        with open(path, 'w') as f:
-            json.dump(vars(self), f)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump({k: v for k, v in vars(self).items() if not k.startswith("_")}, f)
+        os.replace(tmp, path)
 
     @classmethod
     def load_from(cls, path: Path) -> 'Env':
@@ -167,6 +637,7 @@ class Env:
         """
         Update the environment.
         It is okay if the update fails, as the environment will automatically update if the config file is not found when activated, or we can still use the old config file if the config file already exists.
+        The subscription is fetched and converted through the `SubscriptionCache` shared by the envs with the same subscriptions. It is downloaded conditionally and only converted again if its content changed, so the config file is left untouched when the subscription is not modified.
 
         Returns:
             is_updated: bool
@@ -178,45 +649,43 @@ class Env:
 
         try:
             if self.subscriptions:
-                # download the subscription
-                utils.download_file(
-                    urls = self.subscriptions,
-                    path = workdir / "config.yaml.tmp",
-                    desc = "Downloading subscription..."
-                )
-
-                # convert the subscription
-                convert(workdir / "config.yaml.tmp", workdir / "config.yaml")
-
-                # remove the temp file
-                (workdir / "config.yaml.tmp").unlink()
+                # fetch and convert once for all the envs with the same subscriptions
+                cache = SubscriptionCache(self.subscriptions)
+                entry = cache.refresh()
+
+                # the subscription that the current config was converted from
+                state = self._load_subscription_state(workdir)
+                if (workdir / "config.yaml").exists() and state == {"subscriptions": self.subscriptions, "sha256": entry["sha256"]}:
+                    logger.info("The config is up to date.")
+                else:
+                    # the setters replace the config instead of writing to it, so the cached one is never modified
+                    store = ArtifactStore()
+                    snapshot = ConfigSnapshot(cache.config_path, self.codec).snapshot_path
+                    if snapshot.exists():
+                        store.link(snapshot, ConfigSnapshot(workdir / "config.yaml", self.codec).snapshot_path)
+                    store.link(cache.config_path, workdir / "config.yaml")
+                    self._save_subscription_state(workdir, {"subscriptions": self.subscriptions, "sha256": entry["sha256"]})
+
+                # download geoip.metadb, shared by all envs; a private copy is replaced by a link
+                ArtifactStore().link(get_geoip(), workdir / "geoip.metadb")
 
-                # download geoip.metadb
-                utils.download_file(
-                    urls = [
-                        utils.get_latest_github_release("MetaCubeX/meta-rules-dat", "geoip.metadb"),
-                        "https://github.com/MetaCubeX/meta-rules-dat/releases/download/latest/geoip.metadb",
-                        "https://github.com/MetaCubeX/meta-rules-dat/blob/release/geoip.metadb",
+            else:
+                # create an empty subscription file, replacing the one that may be linked to the cache
+                ConfigSnapshot(workdir / "config.yaml", self.codec).dump({
+                    "proxy-groups": [
+                        {
+                            "name": "Select",
+                            "type": "select",
+                            "proxies": ["DIRECT"]
+                        }
                     ],
-                    path = workdir / "geoip.metadb",
-                    desc = "Downloading geoip.metadb..."
-                )
+                    "rules": [
+                        "MATCH,Select"
+                    ]
+                })
 
-            else:
-                # create an empty subscription file
-                with open(workdir / "config.yaml", 'w') as f:
-                    yaml.dump({
-                        "proxy-groups": [
-                            {
-                                "name": "Select",
-                                "type": "select",
-                                "proxies": ["DIRECT"]
-                            }
-                        ],
-                        "rules": [
-                            "MATCH,Select"
-                        ]
-                    }, f)
+            # parse the new config once here, instead of on the next activation
+            ConfigSnapshot(workdir / "config.yaml", self.codec).load()
 
             self.last_updated = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
             self.save(workdir)
@@ -226,58 +695,111 @@ class Env:
             logger.error(f"Failed to update the config file of environment '{self.name}': ({e.__class__.__name__}) {e}")
             return False
 
+    @staticmethod
+    def _load_subscription_state(workdir: Path) -> dict:
+        """
+        Load the subscriptions that config.yaml was converted from, and the sha256 digest of their content.
+        """
+        try:
+            with open(workdir / "subscription.json", "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save_subscription_state(workdir: Path, state: dict) -> None:
+        path = workdir / "subscription.json"
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def config_version(self) -> Optional[Tuple[int, int, int]]:
+        """
+        A token that changes whenever config.yaml is written, or None if there is no config yet.
+        """
+        try:
+            st = (self.workdir / "config.yaml").stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
     def _get_config(self) -> dict:
         """
         Get the subscription config content.
 
         The config file will be parsed into a python object.
         """
-        config_path = self.workdir / "config.yaml"
+        snapshot = ConfigSnapshot(self.workdir / "config.yaml", self.codec)
 
-        def load_from(path: Path) -> dict:
-            with open(path, "r") as f:
-                content = yaml.load(f)
+        def load() -> dict:
+            content = snapshot.load()
             return {} if content is None else content
 
         # if the file is not found or corrupted, try to update it
         try:
-            return load_from(config_path)
-        except (FileNotFoundError, YAMLError):
+            return load()
+        except (FileNotFoundError, *self.codec.errors):
             if not self.update():
                 # still error in processing the script, throw an error.
                 raise FileNotFoundError("The config file is not found or corrupted, we also failed to update it.")
 
         # try to load the file again, this time raise an error if it still fails
-        return load_from(config_path)
+        return load()
 
     def _set_config(self, content: dict):
         """
-        Set the subscription config content.
+        Set the subscription config content. The file is replaced atomically, since the service may be reading it,
+        and its snapshot is refreshed.
+        """
+        ConfigSnapshot(self.workdir / "config.yaml", self.codec).dump(content)
+
+    @contextmanager
+    def edit_config(self) -> Iterator[dict]:
         """
-        config_path = self.workdir / "config.yaml"
+        Edit the subscription config in a transaction: the config file is parsed once, the setters called within
+        the transaction modify it in memory, and it is written once on exit. Nothing is written if an error occurs.
 
-        with open(config_path, "w") as f:
-            yaml.dump(content, f)
+        Example::
+
+            with env.edit_config():
+                env.set_port(7890)
+                env.set_controller(9090)
+
+        Returns:
+            config: dict
+                The parsed config, which can also be modified directly.
+        """
+        # join the outer transaction
+        if self._config is not None:
+            yield self._config
+            return
+
+        self._config = self._get_config()
+        try:
+            yield self._config
+            self._set_config(self._config)
+        finally:
+            self._config = None
 
     def set_port(self, port: int = 7890):
         """
         Set the port of the environment.
         """
-        config = self._get_config()
-        # properly set the port
-        if 'port' in config:
-            del config['port']
-        if 'socks-port' in config:
-            del config['socks-port']
-        if 'redir-port' in config:
-            del config['redir-port']
-        if 'tproxy-port' in config:
-            del config['tproxy-port']
-        if 'mixed-port' in config:
-            del config['mixed-port']
-
-        config['port'] = int(port)
-        self._set_config(config)
+        with self.edit_config() as config:
+            # properly set the port
+            if 'port' in config:
+                del config['port']
+            if 'socks-port' in config:
+                del config['socks-port']
+            if 'redir-port' in config:
+                del config['redir-port']
+            if 'tproxy-port' in config:
+                del config['tproxy-port']
+            if 'mixed-port' in config:
+                del config['mixed-port']
+
+            config['port'] = int(port)
 
     def set_controller(
         self,
@@ -303,43 +825,40 @@ class Env:
             secret: str
                 The secret key of the controller. If the controller is disabled, it will return an empty string.
         """
-        config = self._get_config()
-        # properly set the controller
-        if 'external-controller' in config:
-            del config['external-controller']
-        if 'external-ui' in config:
-            del config['external-ui']
-        if 'secret' in config:
-            del config['secret']
-
-        # if port is None, disable the controller
-        if port is None:
-            self._set_config(config)
-            return ""
-
-        # set proper ip
-        ip = "127.0.0.1" if local_only else "0.0.0.0"
-        secret = secret or secrets.token_urlsafe()
-        config['external-controller'] = f"{ip}:{port}"
-        config['secret'] = secret
-
-        # if ui_folder is None, disable the UI
-        if not ui_folder:
-            self._set_config(config)
-            return secret
-
-        # set the UI
-        ui_folder = Path(ui_folder)
-        if isinstance(ui_folder, Path):
-            ui_folder = ui_folder.resolve()
-        link = self.workdir / "ui"
-        if link.exists():
-            link.unlink()
-        link.symlink_to(ui_folder, target_is_directory=True)
-        config['external-ui'] = str(link)
-        self._set_config(config)
+        with self.edit_config() as config:
+            # properly set the controller
+            if 'external-controller' in config:
+                del config['external-controller']
+            if 'external-ui' in config:
+                del config['external-ui']
+            if 'secret' in config:
+                del config['secret']
+
+            # if port is None, disable the controller
+            if port is None:
+                return ""
+
+            # set proper ip
+            ip = "127.0.0.1" if local_only else "0.0.0.0"
+            secret = secret or secrets.token_urlsafe()
+            config['external-controller'] = f"{ip}:{port}"
+            config['secret'] = secret
+
+            # if ui_folder is None, disable the UI
+            if not ui_folder:
+                return secret
+
+            # set the UI
+            ui_folder = Path(ui_folder)
+            if isinstance(ui_folder, Path):
+                ui_folder = ui_folder.resolve()
+            link = self.workdir / "ui"
+            if link.exists():
+                link.unlink()
+            link.symlink_to(ui_folder, target_is_directory=True)
+            config['external-ui'] = str(link)
 
-        return secret
+            return secret
 
     def set_dialer_proxy(self, config: SlashConfig) -> bool:
         """
@@ -348,75 +867,143 @@ class Env:
         if config.http_server is None:
             return False
 
-        _config = self._get_config()
-        if "proxies" not in _config:
-            _config["proxies"] = []
-        if "proxy-groups" not in _config:
-            _config["proxy-groups"] = []
-
-        # Step 1: set the http proxy
-        #         add a proxy "direct" to the config file
-        proxy = {
-            "name": "direct",
-            "type": "http",
-            "server": config.http_server,
-        }
-        if config.http_port is not None:
-            proxy["port"] = config.http_port
-
-        # Step 2: set the proxy
-        #         add the proxy to the config file
-        for idx in range(len(_config["proxies"])):
-            if _config["proxies"][idx]["name"] == "direct":
-                _config["proxies"][idx] = proxy
-                break
-        else:
-            _config["proxies"].append(proxy)
-
-        # Step 3: setup the proxy group
-        #         add the proxy group "direct-group" to the config file
-        if not any(pg["name"] == "direct-group" for pg in _config["proxy-groups"]):
-            _config["proxy-groups"].append({
-                "name": "direct-group",
-                "type": "select",
-                "proxies": ["direct"]
-            })
-
-        # Step 4: add dialer to all other proxies
-        for p in _config["proxies"]:
-            if p["name"] != "direct":
-                p["dialer-proxy"] = "direct-group"
-
-        # Step 5: replace all direct in proxy groups
-        for pg in _config["proxy-groups"]:
-            if "proxies" in pg:
-                pg["proxies"] = [p if p != "DIRECT" else "direct" for p in pg["proxies"]]
-        self._set_config(_config)
-
-        return True
+        with self.edit_config() as _config:
+            if "proxies" not in _config:
+                _config["proxies"] = []
+            if "proxy-groups" not in _config:
+                _config["proxy-groups"] = []
+
+            # Step 1: set the http proxy
+            #         add a proxy "direct" to the config file
+            proxy = {
+                "name": "direct",
+                "type": "http",
+                "server": config.http_server,
+            }
+            if config.http_port is not None:
+                proxy["port"] = config.http_port
+
+            # Step 2: set the proxy
+            #         add the proxy to the config file
+            for idx in range(len(_config["proxies"])):
+                if _config["proxies"][idx]["name"] == "direct":
+                    _config["proxies"][idx] = proxy
+                    break
+            else:
+                _config["proxies"].append(proxy)
+
+            # Step 3: setup the proxy group
+            #         add the proxy group "direct-group" to the config file
+            if not any(pg["name"] == "direct-group" for pg in _config["proxy-groups"]):
+                _config["proxy-groups"].append({
+                    "name": "direct-group",
+                    "type": "select",
+                    "proxies": ["direct"]
+                })
+
+            # Step 4: add dialer to all other proxies
+            for p in _config["proxies"]:
+                if p["name"] != "direct":
+                    p["dialer-proxy"] = "direct-group"
+
+            # Step 5: replace all direct in proxy groups
+            for pg in _config["proxy-groups"]:
+                if "proxies" in pg:
+                    pg["proxies"] = [p if p != "DIRECT" else "direct" for p in pg["proxies"]]
+
+            return True
+
+
+class EnvRegistry:
+    """
+    An in-memory index of the environments in a directory, kept fresh by file stats instead of rescanning.
+
+    Each env.json is only parsed again when its (mtime, size, inode) changes, and the list of environments is
+    only read again when the mtime of the directory changes. A directory modified within the last second is
+    not trusted, since a coarse mtime (e.g. on NFS) could hide a change made right after the scan.
+    """
+    # the mtime granularity we do not trust (nanoseconds)
+    racy_window = 1_000_000_000
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._envs: Dict[str, Tuple[Tuple[int, int, int], Env]] = {}
+        self._names: Optional[List[str]] = None
+        self._root_mtime: Optional[int] = None
+
+    def get(self, name: str) -> Optional[Env]:
+        """
+        Get an environment by name, with a single stat if it is unchanged.
+        """
+        if not name or "/" in name or name.startswith("."):
+            return None
+
+        path = self.root / name / "env.json"
+        try:
+            st = path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            self._envs.pop(name, None)
+            return None
+
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        cached = self._envs.get(name)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        env = Env.load_from(path)
+        self._envs[name] = (stamp, env)
+        return env
+
+    def names(self) -> List[str]:
+        """
+        Get the names of all environments.
+        """
+        try:
+            mtime = self.root.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.root.mkdir(parents=True, exist_ok=True)
+            mtime = self.root.stat().st_mtime_ns
+
+        if self._names is None or mtime != self._root_mtime:
+            names = sorted(path.name for path in self.root.iterdir() if not path.name.startswith("."))
+            racy = time.time_ns() - mtime < self.racy_window
+            self._names, self._root_mtime = names, (None if racy else mtime)
+        return self._names
+
+    def all(self) -> Dict[str, Env]:
+        """
+        Get all environments.
+        """
+        envs: Dict[str, Env] = {}
+        for name in self.names():
+            env = self.get(name)
+            if env is not None:
+                envs[env.name] = env
+        return envs
+
+
+# one registry per directory, shared by all the managers in this process
+_registries: Dict[Path, EnvRegistry] = {}
 
 
 class EnvsManager:
     def __init__(self):
         # check default envs
-        if "base" not in self.envs:
+        if self.get_env("base") is None:
             self.create_env("base")
 
+    @property
+    def registry(self) -> EnvRegistry:
+        if ENVS_DIR not in _registries:
+            _registries[ENVS_DIR] = EnvRegistry(ENVS_DIR)
+        return _registries[ENVS_DIR]
+
     @property
     def envs(self) -> Dict[str, Env]:
         """
         Get all environments. Hot reload from disk.
         """
-        envs: Dict[str, Env] = {}
-
-        # load envs from disk
-        ENVS_DIR.mkdir(parents=True, exist_ok=True)
-        for env_folder in ENVS_DIR.iterdir():
-            env_file = env_folder / "env.json"
-            env = Env.load_from(env_file)
-            envs[env.name] = env
-
-        return envs
+        return self.registry.all()
 
     def create_env(self, *args, **kwargs) -> Env:
         """
@@ -433,11 +1020,13 @@ class EnvsManager:
                 The created environment.
         """
         env = Env(*args, **kwargs)
-        if env.name in self.envs:
+        if self.get_env(env.name) is not None:
             raise ValueError(f"Environment '{env.name}' already exists.")
 
-        # process in the temp directory
-        with tempfile.TemporaryDirectory() as tmpdir:
+        # process in a hidden directory next to the envs, which the registry ignores; on the same filesystem the
+        # links to the store and the subscription cache stay links, and the move is a rename
+        ENVS_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=ENVS_DIR, prefix=".") as tmpdir:
             workdir = Path(tmpdir)
 
             # download the subscription
@@ -469,7 +1058,8 @@ class EnvsManager:
         return env
 
     def remove_env(self, name: str):
-        if name not in self.envs:
+        env = self.get_env(name)
+        if env is None:
             logger.error(f"Environment '{name}' not found.")
             sys.exit(1)
 
@@ -477,11 +1067,11 @@ class EnvsManager:
             logger.error(f"Cannot remove the default environment '{name}'.")
             sys.exit(1)
 
-        self.envs.get(name).destroy()
+        env.destroy()
         logger.info(f"Environment '{name}' has been removed.")
 
     def get_env(self, name):
-        return self.envs.get(name)
+        return self.registry.get(name)
 
     def get_envs(self):
         return self.envs
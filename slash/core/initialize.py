@@ -2,6 +2,7 @@ import re
 from pathlib import Path
 
 import slash.utils as utils
+from slash.core import shell
 
 
 logger = utils.logger
@@ -39,17 +40,29 @@ def shell_initialize(slash_exe: Path) -> bool:
     """
     # >>> slash initialize >>>
     # !! Contents within this block are managed by 'slash init' !!
-    __slash_setup="$('%(slash_exe)s' 'shell' 'hook' 2> /dev/null)"
-    if [ $? -eq 0 ]; then
-        eval "$__slash_setup"
+    __slash_hook='%(hook_path)s'
+    if [ -f "$__slash_hook" ] && [ ! '%(slash_exe)s' -nt "$__slash_hook" ] && [ ! '%(shell_src)s' -nt "$__slash_hook" ]; then
+        . "$__slash_hook"
+    else
+        __slash_setup="$('%(slash_exe)s' 'shell' 'hook' '--write' 2> /dev/null)"
+        if [ $? -eq 0 ]; then
+            eval "$__slash_setup"
+        fi
+        unset __slash_setup
     fi
-    unset __slash_setup
+    unset __slash_hook
     # <<< slash initialize <<<
     """
     ) % {
         "slash_exe": slash_exe,
+        "hook_path": shell.hook_path(),
+        "shell_src": Path(shell.__file__).resolve(),
     }
 
+    # render the hook now, so that new shells do not need to start Python
+    hook_path = shell.write_hook(slash_exe)
+    logger.info("{:<14}{}".format("generated", hook_path))
+
     replace_str = "__SLASH_REPLACE_ME_B612__"
 
     rc_search = re.search(
@@ -119,6 +132,11 @@ def reversed_shell_initialize(slash_exe: Path) -> bool:
         flags=re.MULTILINE,
     )
 
+    hook_path = shell.hook_path()
+    if hook_path.exists():
+        hook_path.unlink()
+        logger.info("{:<14}{}".format("removed", hook_path))
+
     with open(user_rc_path, "w") as fh:
         fh.write(rc_content)
 
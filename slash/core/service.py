@@ -1,4 +1,3 @@
-import gzip
 import json
 import os
 import socket
@@ -9,16 +8,30 @@ import time
 from pathlib import Path
 from typing import Dict, List, Tuple, Union
 
-import psutil
-import requests
-from filelock import SoftFileLock
-
 import slash.utils as utils
-from slash.core import WORK_DIR, ConfigManager, Env, EnvsManager
+from slash.core import WORK_DIR, ConfigManager, Env, EnvsManager, constants
+from slash.core.store import ArtifactStore
+
 
+filelock = utils.lazy_import("filelock")
+psutil = utils.lazy_import("psutil")
+requests = utils.lazy_import("requests")
 
 logger = utils.logger
 
+MIHOMO_KEY = "https://github.com/MetaCubeX/mihomo/releases/download/v1.19.11/mihomo-linux-amd64-v1.19.11.gz#gunzip"
+YACD_KEY = "https://github.com/MetaCubeX/Yacd-meta/archive/refs/heads/gh-pages.tar.gz"
+
+def get_yacd_tarball() -> Path:
+    """
+    Return the path to the yacd tarball in the artifact store. Download if not found.
+    """
+    return ArtifactStore().fetch(
+        key = YACD_KEY,
+        urls = YACD_KEY,
+        desc = "Downloading dashboard...",
+    )
+
 def get_yacd_workdir() -> Path:
     """
     Return the path to the yacd workdir.
@@ -28,14 +41,9 @@ def get_yacd_workdir() -> Path:
     if not workdir.exists():
 
         logger.info("Preparing dashboard. Please wait, it could take a few minutes...")
-        tar_path = WORK_DIR / "yacd-meta.tar.gz"
 
         # download and cache
-        utils.download_file(
-            urls = "https://github.com/MetaCubeX/Yacd-meta/archive/refs/heads/gh-pages.tar.gz",
-            path = tar_path,
-            desc = "Downloading dashboard...",
-        )
+        tar_path = get_yacd_tarball()
 
         def filter(tarinfo: tarfile.TarInfo, *args) -> tarfile.TarInfo:
             tarinfo.name = Path(tarinfo.name).relative_to("Yacd-meta-gh-pages").as_posix()
@@ -45,38 +53,107 @@ def get_yacd_workdir() -> Path:
         with tarfile.open(tar_path, "r:gz") as tar:
             tar.extractall(workdir, filter=filter)
 
-        # remove the tarball
-        tar_path.unlink()
-
     return workdir
 
+def get_mihomo() -> Path:
+    """
+    Return the path to the mihomo binary in the artifact store. Download if not found.
+    """
+    store = ArtifactStore()
+
+    if store.get(MIHOMO_KEY) is None: # download and cache
+        logger.info("Preparing web environment. Please wait, it could take a few minutes...")
+
+    # Use mihomo to support more protocols
+    return store.fetch(
+        key = MIHOMO_KEY,
+        urls = [
+            "https://github.com/MetaCubeX/mihomo/releases/download/v1.19.11/mihomo-linux-amd64-v1.19.11.gz",
+            "https://gitee.com/jiang-zhida/mihomo/releases/download/v1.16.0/clash.meta-linux-amd64-v1.16.0.gz" # the version on gitee is older
+        ],
+        desc = "Downloading binary...",
+        transform = utils.Gunzip,
+        mode = 0o544, # r-xr--r--
+        segments = 4,
+    )
+
 def get_executable() -> Path:
     """
     Return the path to the executable. Download if not found.
+    The executable is verified against the artifact store, so a corrupted binary is downloaded again instead of executed.
     """
+    return ArtifactStore().link(get_mihomo(), WORK_DIR / "mihomo-v1.19.11")
 
-    # prepare mihomo executable
-    exec_path = WORK_DIR / "mihomo-v1.19.11"
 
-    if not exec_path.exists(): # download and cache
+class ActivationCache:
+    """
+    A per-host cache of the running services, so that the shell hook can activate an env without starting Python.
 
-        logger.info("Preparing web environment. Please wait, it could take a few minutes...")
-        WORK_DIR.mkdir(parents=True, exist_ok=True)
-
-        # Use mihomo to support more protocols
-        utils.download_file(
-            urls = [
-                "https://github.com/MetaCubeX/mihomo/releases/download/v1.19.11/mihomo-linux-amd64-v1.19.11.gz",
-                "https://gitee.com/jiang-zhida/mihomo/releases/download/v1.16.0/clash.meta-linux-amd64-v1.16.0.gz" # the version on gitee is older
-            ],
-            path = exec_path,
-            desc = "Downloading binary...",
-            write_callback = lambda src, tgt: tgt.write(gzip.decompress(src.read()))
-        )
+    The hook reads the pid and port of the service, checks that the pid is alive, and registers the job of the
+    shell with an append to the jobs file. The jobs are merged into the service the next time it is loaded.
+    To stop a service, the entry is removed before the jobs are claimed, and the hook checks the entry again
+    after the append, so a job is either claimed before the decision to stop or left to the full path.
+
+    Layout::
+
+        activate/<hostname>/<env>        "<pid> <port>" of the service running on this host
+        activate/<hostname>/<env>.jobs   the jobs registered by the shell hook, one per line
+    """
+    def __init__(self, env_name: str) -> None:
+        self.env_name = env_name
+
+    @staticmethod
+    def root() -> Path:
+        return constants.WORK_DIR / "activate"
+
+    @property
+    def path(self) -> Path:
+        return self.root() / socket.gethostname() / self.env_name
+
+    @property
+    def jobs_path(self) -> Path:
+        return self.path.with_name(f"{self.env_name}.jobs")
 
-        exec_path.chmod(mode = 484) # rwxr--r--
+    def write(self, pid: int, port: int) -> None:
+        """
+        Record the running service. The file is replaced atomically, since the shell may read it at any time.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.env_name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            f.write(f"{pid} {port}\n")
+        os.replace(tmp, self.path)
 
-    return exec_path
+    def remove(self) -> None:
+        """
+        Forget the service, the shell will take the full path to activate the env.
+        """
+        self.path.unlink(missing_ok=True)
+
+    def pending(self) -> List[str]:
+        """
+        Return the jobs registered by the shell hook, without consuming them.
+        """
+        try:
+            with open(self.jobs_path, "r") as f:
+                return [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def claim(self) -> List[str]:
+        """
+        Consume the jobs registered by the shell hook. The file is renamed before it is read, so a job appended
+        meanwhile goes to a new file instead of being lost.
+        """
+        claimed = self.jobs_path.with_name(f".{self.env_name}.jobs.{os.getpid()}")
+        try:
+            os.replace(self.jobs_path, claimed)
+        except FileNotFoundError:
+            return []
+        with open(claimed, "r") as f:
+            jobs = [line.strip() for line in f if line.strip()]
+        claimed.unlink()
+        return jobs
 
 
 class Service:
@@ -87,6 +164,8 @@ class Service:
             self.ctl = tuple(ctl) # (ctl_port, secret)
         self.env = env
         self.jobs = jobs
+        # the jobs registered by the shell hook, merged when the service was loaded
+        self._hook_jobs: List[str] = []
 
     def get_controller_urls(self) -> List[str]:
         """
@@ -131,19 +210,13 @@ class Service:
 
         # 2. check that the service is ready
         test_url = "https://www.baidu.com"
-        original_proxy = os.environ.get("https_proxy", None)
+        proxies = {"https": f"http://127.0.0.1:{self.port}"}
         try:
-            os.environ["https_proxy"] = f"http://127.0.0.1:{self.port}"
-            r = requests.get(test_url, timeout=5)
+            r = utils.get_session("local").get(test_url, proxies=proxies, timeout=5)
             if r.status_code >= 500:
                 return False
         except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
             return False
-        finally:
-            if original_proxy is not None:
-                os.environ["https_proxy"] = original_proxy
-            else:
-                del os.environ["https_proxy"]
 
         return True
 
@@ -159,14 +232,15 @@ class Service:
                 The only identifier to the job.
         """
         with utils.FreePort() as fp, utils.FreePort() as fp_ctl:
-            # set the port
-            env.set_port(fp.port)
+            with env.edit_config():
+                # set the port
+                env.set_port(fp.port)
 
-            # set the controller
-            secret = env.set_controller(fp_ctl.port, get_yacd_workdir())
+                # set the controller
+                secret = env.set_controller(fp_ctl.port, get_yacd_workdir())
 
-            # possibly set the dialer proxy
-            env.set_dialer_proxy(ConfigManager().get_config())
+                # possibly set the dialer proxy
+                env.set_dialer_proxy(ConfigManager().get_config())
 
             # start the service
             pid = utils.runbg(['nohup', str(get_executable()), "-d", str(env.workdir)])
@@ -220,9 +294,10 @@ class Service:
 
         # update the config
         port, secret = self.ctl
-        self.env.set_port(self.port)
-        self.env.set_controller(port, get_yacd_workdir(), secret=secret)
-        self.env.set_dialer_proxy(ConfigManager().get_config())
+        with self.env.edit_config():
+            self.env.set_port(self.port)
+            self.env.set_controller(port, get_yacd_workdir(), secret=secret)
+            self.env.set_dialer_proxy(ConfigManager().get_config())
 
         # update the service
         url = f'http://127.0.0.1:{port}/configs'
@@ -231,7 +306,7 @@ class Service:
             "Authorization": f"Bearer {secret}"
         }
         payload = '{"path": "", "payload": ""}'
-        response = requests.put(url, headers=headers, data=payload)
+        response = utils.get_session("local").put(url, headers=headers, data=payload)
 
         if response.status_code != 204:
             logger.warn(f"Service '{self.env.name}' update failed. The config file might have been changed, but the web service will remain unchanged.")
@@ -262,9 +337,13 @@ class Service:
     @classmethod
     def load(cls, env: Env) -> Union['Service', None]:
         """
-        Load a service from the default path.
+        Load a service from the default path, with the jobs registered by the shell hook.
         """
-        return cls.load_from(env, env.workdir / "service.json")
+        service = cls.load_from(env, env.workdir / "service.json")
+        if service is not None:
+            service._hook_jobs = ActivationCache(env.name).pending()
+            service.jobs.extend(job for job in service._hook_jobs if job not in service.jobs)
+        return service
 
     @classmethod
     def load_from(cls, env: Env, path: Path) -> Union['Service', None]:
@@ -273,7 +352,7 @@ class Service:
         """
         hostname = socket.gethostname()
 
-        with SoftFileLock(path.with_suffix(".lock")):
+        with filelock.SoftFileLock(path.with_suffix(".lock")):
             data = {}
 
             # read the service data
@@ -299,9 +378,19 @@ class Service:
 
     def save(self) -> None:
         """
-        Save the service to a json file.
+        Save the service to the default path, and refresh the activation cache of this host.
         """
+        cache = ActivationCache(self.env.name)
+
+        # the jobs registered by the shell hook after the service was loaded
+        self.jobs.extend(job for job in cache.claim() if job not in self._hook_jobs and job not in self.jobs)
+        self._hook_jobs = []
+
         self.save_to(self.env.workdir / "service.json")
+        if self.is_alive():
+            cache.write(self.pid, self.port)
+        else:
+            cache.remove()
 
     def save_to(self, path: Path) -> None:
         """
@@ -309,7 +398,7 @@ class Service:
         """
         hostname = socket.gethostname()
 
-        with SoftFileLock(path.with_suffix(".lock")):
+        with filelock.SoftFileLock(path.with_suffix(".lock")):
             data = {}
 
             # read the service data
@@ -336,10 +425,18 @@ class ServiceManager:
     def __init__(self) -> None:
         pass
 
+    def get_service(self, env: Env) -> Union[Service, None]:
+        """
+        Return the service of an environment on this host, or None if it is not running. Hot reload from disk.
+        Only the state file of this environment is read.
+        """
+        return Service.load(env)
+
     @property
     def services(self) -> Dict[str, Service]:
         """
-        Return the services. Hot reload from disk.
+        Return the services of all environments. Hot reload from disk.
+        Use `get_service` to look up a single environment.
         """
         services: Dict[str, Service] = {}
 
@@ -361,8 +458,8 @@ class ServiceManager:
             job: str
                 The name of job to be launched.
         """
-        with SoftFileLock(env.workdir / "service_manager.lock"):
-            service = self.services.get(env.name, None)
+        with filelock.SoftFileLock(env.workdir / "service_manager.lock"):
+            service = self.get_service(env)
 
             # if the service does not exist, launch a new one
             if service is None:
@@ -375,13 +472,15 @@ class ServiceManager:
                 logger.error(f"Try to launch {job} for {env.name}, but service is not alive.")
                 raise ValueError(f"Service of {env.name} is not alive.")
 
-            # check if the job is already running
-            if job in service.jobs:
+            # check if the job is already running; a job registered by the shell hook is adopted, the hook
+            # falls back to the full path when it races with a stop
+            if job in service.jobs and job not in service._hook_jobs:
                 logger.error(f"Try to launch {job} for {env.name}, but job is already running.")
                 raise ValueError(f"Job {job} is already running.")
 
             # add the job to the service
-            service.jobs.append(job)
+            if job not in service.jobs:
+                service.jobs.append(job)
             service.save()
             return service
 
@@ -389,8 +488,8 @@ class ServiceManager:
         """
         Stop a service.
         """
-        with SoftFileLock(env.workdir / "service_manager.lock"):
-            service = self.services.get(env.name, None)
+        with filelock.SoftFileLock(env.workdir / "service_manager.lock"):
+            service = self.get_service(env)
 
             # if the service does not exist, do nothing
             if service is None:
@@ -401,6 +500,13 @@ class ServiceManager:
             if not service.is_alive():
                 logger.error(f"Try to stop {job} for {env.name}, but service of {env.name} not alive.")
 
+            # close the fast path of the shell hook first, then claim the jobs it registered, so that no job
+            # is appended between the claim and the decision to stop
+            cache = ActivationCache(env.name)
+            cache.remove()
+            service.jobs.extend(job for job in cache.claim() if job not in service._hook_jobs and job not in service.jobs)
+            service._hook_jobs = []
+
             # remove the job from the service
             if job in service.jobs:
                 service.jobs.remove(job)
@@ -5,6 +5,7 @@ import shlex
 from pathlib import Path
 
 import slash.utils as utils
+from slash.core import constants
 
 
 def hook(slash_exe: Path) -> str:
@@ -27,7 +28,27 @@ def hook(slash_exe: Path) -> str:
         fi
     }
 
+    __slash_activate_cached() {
+        # activate without starting slash, if the service of the env is already running on this host
+        [ "$#" -le 2 ] && [ -z "${SLASH_ENV:-}" ] && [ -z "${http_proxy:-}" ] && [ -z "${https_proxy:-}" ] || \\return 1
+        \\local name="${2:-base}" host="${HOSTNAME:-${HOST:-}}" pid port
+        case "$name" in
+            ""|-*|*[!A-Za-z0-9_.-]*) \\return 1 ;;
+        esac
+        [ -n "$host" ] && [ -r "%(activate_dir)s/$host/$name" ] || \\return 1
+        \\read -r pid port < "%(activate_dir)s/$host/$name" || \\return 1
+        [ -n "$port" ] && \\kill -0 "$pid" 2> /dev/null || \\return 1
+        \\printf '__pid_%%s_shell__\\n' "$$" >> "%(activate_dir)s/$host/$name.jobs" || \\return 1
+        # a concurrent stop removes the entry before it claims the jobs; if it is gone, the job may have missed
+        # the claim, so take the full path, which adopts the job
+        \\local check
+        [ -r "%(activate_dir)s/$host/$name" ] && \\read -r check port < "%(activate_dir)s/$host/$name" || \\return 1
+        [ "$check" = "$pid" ] && \\kill -0 "$pid" 2> /dev/null || \\return 1
+        %(activate)s
+    }
+
     __slash_activate() {
+        __slash_activate_cached "$@" && \\return
         \\local ask_slash
         ask_slash="$(PS1="${PS1:-}" __slash_exe shell "$@" --shell_pid "$$" )" || \\return
         \\eval "$ask_slash"
@@ -58,9 +79,46 @@ def hook(slash_exe: Path) -> str:
     """
     ) % {
         "slash_exe": slash_exe,
+        "activate_dir": constants.WORK_DIR / "activate",
+        # the same exports as `activate`, evaluated by the shell
+        "activate": "\n    ".join(activate("${name}", "${port}").splitlines()),
     }
     return s
 
+def hook_path() -> Path:
+    """
+    The path to the cached shell hook, which is sourced by the shell configuration file.
+    """
+    return constants.WORK_DIR / "hook.sh"
+
+def write_hook(slash_exe: Path) -> Path:
+    """
+    Render the shell hook into `hook_path`, so that new shells can source it without starting Python.
+
+    The shell configuration file regenerates the hook with `slash shell hook --write` once the slash
+    executable or this module is newer than the cached hook, i.e. after slash is upgraded or reinstalled.
+
+    Arguments:
+        slash_exe: The path to the slash executable.
+
+    Returns:
+        path: The path to the cached hook.
+    """
+    path = hook_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    content = "\n".join([
+        "# Generated by 'slash init'. Do not edit, it is regenerated when slash is upgraded.",
+        hook(slash_exe),
+        "",
+    ])
+
+    # replace atomically, a new shell may be sourcing it right now
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+    return path
+
 def activate(env_name: str, port: int, stash: dict = None) -> str:
     """
     Generate a shell activation script.
@@ -0,0 +1,310 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import slash.utils as utils
+from slash.core import constants
+
+
+filelock = utils.lazy_import("filelock")
+requests = utils.lazy_import("requests")
+
+logger = utils.logger
+
+Urls = Union[str, List[str], Callable[[], Union[str, List[str]]]]
+
+
+def sha256sum(path: Path) -> str:
+    """
+    Compute the sha256 digest of a file.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ArtifactStore:
+    """
+    A content-addressed store for the downloaded artifacts.
+
+    The blobs are keyed by their sha256 digest, and an index maps each artifact key (the canonical url
+    of the artifact, with an optional ``#transform`` suffix) to the digest of its current blob. Users of
+    an artifact hardlink the blob instead of keeping a copy, so a blob whose link count is 1 is only
+    referenced by the store and can be evicted.
+
+    Layout::
+
+        store/
+            index.json          key -> {digest, size, stat, time, used, pinned}
+            blobs/ab/abcdef...  the blobs, read-only
+            locks/              one lock per artifact key
+            tmp/                downloads in progress
+    """
+    # evict unreferenced blobs beyond this total size (bytes)
+    max_size = 256 << 20
+    # refresh the last access time at most this often (seconds)
+    touch_interval = 60 * 60
+
+    def __init__(self, root: Optional[Path] = None) -> None:
+        self._root = root
+
+    @property
+    def root(self) -> Path:
+        if self._root is not None:
+            return self._root
+        return constants.WORK_DIR / "store"
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / "index.json"
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / digest
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _lock(self, key: str) -> "filelock.SoftFileLock":
+        (self.root / "locks").mkdir(parents=True, exist_ok=True)
+        return filelock.SoftFileLock(self.root / "locks" / f"{self._name(key)}.lock")
+
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_index(self, index: Dict[str, dict]) -> None:
+        with tempfile.NamedTemporaryFile("w", dir=self.root, delete=False) as f:
+            json.dump(index, f)
+        os.replace(f.name, self.index_path)
+
+    def _update_index(self, update: Callable[[Dict[str, dict]], None]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with filelock.SoftFileLock(self.root / "index.lock"):
+            index = self._load_index()
+            update(index)
+            self._save_index(index)
+
+    @staticmethod
+    def _stamp(path: Path) -> List[int]:
+        st = path.stat()
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def verify(self, digest: str, stamp: Optional[List[int]] = None) -> bool:
+        """
+        Verify a blob. The blob is only re-hashed if its stat differs from the stamp taken when it was stored.
+        """
+        path = self.blob_path(digest)
+        try:
+            if stamp is not None and self._stamp(path) == stamp:
+                return True
+            return sha256sum(path) == digest
+        except FileNotFoundError:
+            return False
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Path]:
+        """
+        Get the blob of an artifact.
+
+        Arguments:
+            key (str): The key of the artifact.
+            max_age (float): Treat the artifact as missing if it was fetched more than max_age seconds ago.
+                Pinned artifacts never expire.
+
+        Returns:
+            The path to the verified blob, or None if the artifact is missing, expired or corrupted.
+        """
+        entry = self._load_index().get(key)
+        if entry is None:
+            return None
+
+        now = time.time()
+        if max_age is not None and not entry.get("pinned") and now - entry["time"] > max_age:
+            return None
+
+        if not self.verify(entry["digest"], entry.get("stat")):
+            logger.warn(f"Cached artifact is corrupted, discard it: {key}")
+            self._update_index(lambda index: index.pop(key, None))
+            return None
+
+        if now - entry.get("used", 0) > self.touch_interval:
+            def touch(index: Dict[str, dict]) -> None:
+                if key in index:
+                    index[key]["used"] = now
+            self._update_index(touch)
+
+        return self.blob_path(entry["digest"])
+
+    def put(self, key: str, path: Path, mode: int = 0o444, pinned: bool = False) -> Path:
+        """
+        Move a file into the store and register it under the key.
+
+        Arguments:
+            key (str): The key of the artifact.
+            path (Path): The file to store. It is moved, not copied, and should be on the same filesystem.
+            mode (int): The permission of the blob.
+            pinned (bool): Keep the artifact regardless of the max_age of `get`, e.g. for an offline node that cannot
+                download it again. Replaced by the next put of the key.
+
+        Returns:
+            The path to the blob.
+        """
+        digest = sha256sum(path)
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+
+        # gc removes the unindexed blobs under the index lock, so the blob must be indexed under the same lock
+        with filelock.SoftFileLock(self.root / "index.lock"):
+            if blob.exists() and self.verify(digest):
+                path.unlink()
+            else:
+                path.chmod(mode)
+                os.replace(path, blob)
+
+            now = time.time()
+            index = self._load_index()
+            index[key] = {"digest": digest, "size": blob.stat().st_size, "stat": self._stamp(blob), "time": now, "used": now}
+            if pinned:
+                index[key]["pinned"] = True
+            self._save_index(index)
+
+        self.gc()
+        return blob
+
+    def fetch(
+        self,
+        key: str,
+        urls: Urls,
+        desc: str = "Downloading...",
+        write_callback = None,
+        mode: int = 0o444,
+        max_age: Optional[float] = None,
+        segments: int = 1,
+        transform: Optional[Callable[[], utils.Transform]] = None,
+        stale_if_error: bool = False,
+    ) -> Path:
+        """
+        Get the blob of an artifact, download it if it is not in the store.
+
+        Arguments:
+            key (str): The key of the artifact, usually its canonical url.
+            urls (Urls): The urls to download from. It can be a callable, which is only resolved on a cache miss.
+            desc (str): The description of the download.
+            write_callback: See `utils.download_file`.
+            mode (int): The permission of the blob.
+            max_age (float): Download again if the artifact was fetched more than max_age seconds ago.
+            segments (int): See `utils.download_file`.
+            transform: See `utils.download_file`.
+            stale_if_error (bool): Fall back to an expired artifact if the download fails.
+
+        Returns:
+            The path to the blob.
+        """
+        with self._lock(key):
+            blob = self.get(key, max_age=max_age)
+            if blob is not None:
+                return blob
+
+            # keep the partial download of each key, so that an interrupted download resumes next time
+            tmp_dir = self.root / "tmp" / self._name(key)
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            path = tmp_dir / "artifact"
+            try:
+                if callable(urls):
+                    urls = urls()
+                utils.download_file(
+                    urls=urls, path=path, desc=desc, write_callback=write_callback, segments=segments, transform=transform
+                )
+            except requests.exceptions.RequestException:
+                blob = self.get(key) if stale_if_error else None
+                if blob is None:
+                    raise
+                logger.warn(f"Failed to refresh {key}, use the cached one.")
+                return blob
+            blob = self.put(key, path, mode=mode)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return blob
+
+    def link(self, blob: Path, target: Path) -> Path:
+        """
+        Make the target a hardlink to the blob. Fall back to a copy if hardlinks are not supported.
+        The target is replaced atomically, and left untouched if it is already a link to the blob.
+        """
+        try:
+            if os.path.samefile(blob, target):
+                return target
+        except FileNotFoundError:
+            pass
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            os.link(blob, tmp)
+        except OSError as e:
+            # only copy if hardlinks are not possible here, other errors are real failures
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copy2(blob, tmp)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+        return target
+
+    def gc(self, max_size: Optional[int] = None) -> None:
+        """
+        Remove the blobs that are not in the index and not linked anywhere, then evict the least recently
+        used unreferenced blobs until the store fits in max_size.
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        blobs_dir = self.root / "blobs"
+        if not blobs_dir.exists():
+            return
+
+        with filelock.SoftFileLock(self.root / "index.lock"):
+            index = self._load_index()
+            indexed = {entry["digest"] for entry in index.values()}
+
+            total = 0
+            for blob in blobs_dir.glob("*/*"):
+                st = blob.stat()
+                if blob.name not in indexed and st.st_nlink <= 1:
+                    blob.unlink()
+                else:
+                    total += st.st_size
+
+            # least recently used first
+            for key, entry in sorted(index.items(), key=lambda item: item[1].get("used", 0)):
+                if total <= max_size:
+                    break
+                if key not in index:
+                    continue
+                blob = self.blob_path(entry["digest"])
+                if not blob.exists():
+                    del index[key]
+                    continue
+                st = blob.stat()
+                if st.st_nlink > 1:
+                    continue # still linked by someone
+                # other keys may share the blob
+                for other in [k for k, e in index.items() if e["digest"] == entry["digest"]]:
+                    del index[other]
+                blob.unlink()
+                total -= st.st_size
+
+            self._save_index(index)
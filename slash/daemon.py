@@ -7,12 +7,12 @@ import time
 from pathlib import Path
 from typing import List
 
-import filelock
-
 import slash.utils as utils
 from slash.core import WORK_DIR, EnvsManager, ServiceManager
 
 
+filelock = utils.lazy_import("filelock")
+
 logger = utils.logger
 
 
@@ -1,5 +1,8 @@
 import os
-from typing import Dict
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NoReturn
 
 import slash.utils as utils
 from slash.core import ConfigManager, Env, EnvsManager, Service, ServiceManager
@@ -9,14 +12,31 @@ from slash.daemon import ProcessDaemon
 logger = utils.logger
 
 
+class lazy_manager:
+    """
+    A class attribute that is created on first access, then cached on the class.
+    The managers touch the disk when they are created, which should not happen on `import slash`.
+    """
+    def __init__(self, factory) -> None:
+        self.factory = factory
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj, owner):
+        value = self.factory()
+        setattr(owner, self.name, value)
+        return value
+
+
 class Slash:
     """
     The main interface of the Slash library.
     """
     daemons = [ProcessDaemon]
-    config = ConfigManager()
-    envs_manager = EnvsManager()
-    service_manager = ServiceManager()
+    config = lazy_manager(ConfigManager)
+    envs_manager = lazy_manager(EnvsManager)
+    service_manager = lazy_manager(ServiceManager)
 
     def __init__(self, env_name: str = 'base') -> None:
         self.env_name = env_name
@@ -31,7 +51,8 @@ class Slash:
 
     @property
     def service(self) -> Service:
-        return self.service_manager.services.get(self.env_name, None)
+        env = self.env
+        return None if env is None else self.service_manager.get_service(env)
 
     def launch(self, job: str) -> Service:
         """
@@ -45,16 +66,86 @@ class Slash:
         """
         self.service_manager.stop(self.env, job)
 
+    def exec(self, args: List[str]) -> NoReturn:
+        """
+        Replace the current process with the command, with the proxy of the environment.
+
+        The job is registered under the pid of the current process, which the command keeps after exec. The
+        process daemon releases the job when the command exits, so no Python process stays around for the job.
+
+        Arguments:
+            args (List[str]): The command and its arguments.
+        """
+        job = "__pid_{pid}_run__".format(pid=os.getpid())
+        service = self.launch(job)
+
+        env = dict(os.environ)
+        env['http_proxy'] = f"http://127.0.0.1:{service.port}"
+        env['https_proxy'] = f"http://127.0.0.1:{service.port}"
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            os.execvpe(args[0], args, env)
+        except OSError as e:
+            logger.error(f"Failed to run {args[0]}: {e}")
+            self.stop(job)
+            sys.exit(127)
+
     def update(self) -> bool:
         """
         Update the environment.
         If the service is running, update the service as well.
         """
-        is_updated = self.env.update()
-        if is_updated and (service := self.service) is not None:
+        return self._update_env(self.env)
+
+    @classmethod
+    def _update_env(cls, env: Env) -> bool:
+        version = env.config_version()
+        is_updated = env.update()
+        # the service only reloads a config that changed
+        if is_updated and env.config_version() != version and (service := cls.service_manager.get_service(env)) is not None:
             service.update()
         return is_updated
 
+    @classmethod
+    def update_many(cls, names: List[str], workers: int = 4) -> List[str]:
+        """
+        Update several environments concurrently, at most `workers` at a time, with one progress row per
+        environment. The running service of an environment is updated as soon as the environment is.
+
+        Arguments:
+            names (List[str]): The names of the environments.
+            workers (int): The maximum number of environments updated at the same time.
+
+        Returns:
+            The names of the environments that failed to update.
+        """
+        with utils.shared_progress() as progress:
+            tasks = {name: progress.add_task("update", filename=name, idx="queued", status=True, total=None, start=False) for name in names}
+
+            def update(name: str) -> bool:
+                task = tasks[name]
+                progress.start_task(task)
+                progress.update(task, idx="updating")
+                env = cls.envs_manager.get_env(name)
+                try:
+                    if env is None:
+                        logger.error(f"Environment '{name}' does not exist.")
+                        is_updated = False
+                    else:
+                        is_updated = cls._update_env(env)
+                except Exception as e:
+                    logger.error(f"Failed to update environment '{name}': ({e.__class__.__name__}) {e}")
+                    is_updated = False
+                progress.update(task, idx="done" if is_updated else "failed", total=1, completed=1)
+                return is_updated
+
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="slash-update") as pool:
+                results = dict(zip(names, pool.map(update, names)))
+
+        return [name for name, is_updated in results.items() if not is_updated]
+
     def info(self) -> Dict[str, str]:
         """
         Get the environment information.
@@ -84,6 +175,9 @@ class Slash:
             name (str): The name of the environment.
             file (str): The path to the environment file, or the link to the subscription.
         """
+        if file:
+            # local files are read again on each update, from any directory
+            file = [str(Path(f).resolve()) if Path(f).is_file() else f for f in file]
         cls.envs_manager.create_env(name, file)
 
     @classmethod
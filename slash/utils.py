@@ -1,21 +1,59 @@
+import importlib
+import json
 import os
+import queue
 import random
 import re
 import socket
 import subprocess
 import tempfile
+import threading
 import time
+import zlib
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from textwrap import dedent
-from typing import Iterable, List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
 
-import filelock
-import psutil
-import requests
-from faker import Faker
-from rich.console import Console
-from rich.progress import BarColumn, DownloadColumn, Progress, TextColumn, TimeRemainingColumn, TransferSpeedColumn
-from rich.status import Status
+
+if TYPE_CHECKING:
+    import rich.console
+    import rich.progress
+    import rich.status
+
+
+class LazyObject:
+    """
+    A stand-in for an object that is only created on first attribute access.
+
+    Importing slash should not pay for the heavy dependencies (requests, psutil, filelock, ...) until they are
+    used, so that ``import slash`` and the shell commands stay fast.
+    """
+    def __init__(self, factory: Callable[[], object], name: str) -> None:
+        self.__dict__["_factory"] = factory
+        self.__dict__["_name"] = name
+        self.__dict__["_object"] = None
+
+    def __getattr__(self, attr: str):
+        obj = self.__dict__["_object"]
+        if obj is None:
+            obj = self.__dict__["_object"] = self._factory()
+        return getattr(obj, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy '{self._name}'>"
+
+def lazy_import(name: str) -> LazyObject:
+    """
+    Import a module on first use.
+    """
+    return LazyObject(lambda: importlib.import_module(name), name)
+
+filelock = lazy_import("filelock")
+psutil = lazy_import("psutil")
+requests = lazy_import("requests")
+requests_adapters = lazy_import("requests.adapters")
 
 PROXY_RULES = [
     [
@@ -254,9 +292,61 @@ PROXY_RULES = [
     ]
 ]
 
+class MirrorRules:
+    """
+    The compiled index of mirror rules, such as PROXY_RULES.
+
+    The patterns are compiled once, duplicated replacements are dropped, and the rules are keyed by the
+    host in their pattern, so that a url is only tested against the rules of its own host.
+    """
+    def __init__(self, rules: List[Tuple[str, List[str]]]) -> None:
+        self._index: Dict[Optional[str], List[Tuple[re.Pattern, List[str]]]] = {}
+        for pattern, replacements in rules:
+            entry = (re.compile(pattern), list(dict.fromkeys(replacements)))
+            self._index.setdefault(self._host_of(pattern), []).append(entry)
+
+    @staticmethod
+    def _host_of(pattern: str) -> Optional[str]:
+        """
+        The literal host of a pattern, or None if the pattern may match any host.
+        """
+        match = re.match(r"^\^https\?://([\w\-.\\]+)/", pattern)
+        return match.group(1).replace("\\", "").lower() if match else None
+
+    def expand(self, url: str) -> List[str]:
+        """
+        Expand a url into itself followed by its mirrors. The first matching rule wins.
+        """
+        host = urlsplit(url).netloc.lower()
+        for pattern, replacements in self._index.get(host, []) + self._index.get(None, []):
+            match = pattern.match(url)
+            if match:
+                return [url] + [match.expand(replacement) for replacement in replacements]
+        return [url]
+
+# compiled on first use
+mirror_rules = LazyObject(lambda: MirrorRules(PROXY_RULES), "MirrorRules")
+
+def expand_urls(urls: Union[str, List[str]]) -> List[str]:
+    """
+    Expand the urls with their mirrors in PROXY_RULES. Each url is followed by its mirrors, and duplicates are removed.
+    """
+    if not isinstance(urls, list):
+        urls = [urls]
+    return list(dict.fromkeys(mirror for url in urls for mirror in mirror_rules.expand(url)))
+
+
 class Logger:
     def __init__(self) -> None:
-        self.console = Console(stderr=True)
+        self._console = None
+
+    @property
+    def console(self) -> "rich.console.Console":
+        # rich is only imported when the first message is logged
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console(stderr=True)
+        return self._console
 
     def debug(self, *args, **kwargs) -> None:
         self.console.log("[blue]DEBUG[/blue] |", *args, **kwargs)
@@ -270,7 +360,7 @@ class Logger:
     def error(self, *args, **kwargs) -> None:
         self.console.log("[red]ERRO[/red] |", *args, **kwargs)
 
-    def status(self, *args, **kwargs) -> Status:
+    def status(self, *args, **kwargs) -> "rich.status.Status":
         return self.console.status(*args, **kwargs)
 
     def mute(self) -> None:
@@ -281,6 +371,9 @@ class Logger:
 
 logger = Logger()
 
+# chunk size of the downloads (bytes)
+CHUNK_SIZE = 1 << 16
+
 
 class FreePort:
     def __init__(self, ports: Iterable = None, timeout: int = -1) -> None:
@@ -354,97 +447,720 @@ class FreePort:
 
 
 
+class MirrorScoreboard:
+    """
+    A persistent scoreboard of the mirror hosts.
+
+    Each download attempt appends one json line to a log file under WORK_DIR. The log is append-only
+    and every entry is written with a single O_APPEND write, so processes share it without locking.
+    The entries are folded with an exponential decay, so a mirror that failed a while ago is retried
+    once its failures fade out.
+    """
+    # entries older than this are worth half
+    half_life = 24 * 60 * 60
+    # compact the log once it grows beyond this size (bytes)
+    max_size = 1 << 20
+    # assumed cost of an unknown mirror
+    default_ttfb = 1.0
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        if self._path is not None:
+            return self._path
+        from slash.core import constants
+        return constants.WORK_DIR / "mirrors.log"
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlsplit(url).netloc
+
+    def record(self, url: str, ok: bool, ttfb: Optional[float] = None, speed: Optional[float] = None) -> None:
+        """
+        Record a download attempt.
+
+        Arguments:
+            url (str): The url of the attempt.
+            ok (bool): Whether the attempt succeeded.
+            ttfb (float): Time to first byte, in seconds.
+            speed (float): Throughput of the transfer, in bytes per second.
+        """
+        entry = {"host": self.host(url), "t": time.time(), "s": int(ok), "f": int(not ok)}
+        if ttfb is not None:
+            entry["ttfb"] = round(ttfb, 3)
+        if speed is not None:
+            entry["speed"] = round(speed)
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(entry) + "\n").encode())
+            finally:
+                os.close(fd)
+        except OSError:
+            pass # the scoreboard is only a hint
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Fold the log into decayed statistics for each host.
+        """
+        now = time.time()
+        stats: Dict[str, dict] = {}
+
+        try:
+            with open(self.path, "r") as f:
+                lines = f.readlines()
+        except OSError:
+            return stats
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                weight = 0.5 ** (max(0.0, now - entry["t"]) / self.half_life)
+                stat = stats.setdefault(entry["host"], {"s": 0.0, "f": 0.0, "ttfb": [0.0, 0.0], "speed": [0.0, 0.0]})
+                stat["s"] += weight * entry["s"]
+                stat["f"] += weight * entry["f"]
+                for key in ("ttfb", "speed"):
+                    if key in entry:
+                        stat[key][0] += weight * entry[key]
+                        stat[key][1] += weight
+            except (ValueError, KeyError, TypeError):
+                continue # skip torn or malformed lines
+
+        if sum(len(line) for line in lines) > self.max_size:
+            self.compact(stats, now)
+
+        return stats
+
+    def compact(self, stats: Dict[str, dict], now: float) -> None:
+        """
+        Rewrite the log with one folded entry per host.
+        Entries appended while rewriting may be lost, which is fine for a hint.
+        """
+        lines = []
+        for host, stat in stats.items():
+            entry = {"host": host, "t": now, "s": stat["s"], "f": stat["f"]}
+            for key in ("ttfb", "speed"):
+                total, weight = stat[key]
+                if weight > 0:
+                    entry[key] = total / weight
+            lines.append(json.dumps(entry) + "\n")
+
+        try:
+            with tempfile.NamedTemporaryFile("w", dir=self.path.parent, delete=False) as f:
+                f.writelines(lines)
+            os.replace(f.name, self.path)
+        except OSError:
+            pass
+
+    def score(self, stat: Optional[dict]) -> float:
+        """
+        The expected value of a mirror. Higher is better; unknown mirrors get a neutral score.
+        """
+        if stat is None:
+            return 0.5 / (1 + self.default_ttfb)
+
+        success = (stat["s"] + 0.5) / (stat["s"] + stat["f"] + 1)
+        total, weight = stat["ttfb"]
+        cost = total / weight if weight > 0 else self.default_ttfb
+        total, weight = stat["speed"]
+        if weight > 0 and total > 0:
+            cost += weight / total * (1 << 20) # seconds per MiB
+        return success / (1 + cost)
+
+    def sort(self, urls: List[str]) -> List[str]:
+        """
+        Sort the urls by the score of their hosts, best first. The order of ties is kept.
+        """
+        stats = self.stats()
+        return sorted(urls, key=lambda url: -self.score(stats.get(self.host(url))))
+
+mirrors = MirrorScoreboard()
+
+
+
 def dals(string):
     """dedent and left-strip"""
     return dedent(string).lstrip()
 
+_sessions: Dict[str, "requests.Session"] = {}
+_sessions_lock = threading.Lock()
+_user_agents: List[str] = []
+
+def user_agent() -> str:
+    """
+    Get a random User-Agent. The pool is generated once per process, so Faker is not set up for every request.
+    """
+    with _sessions_lock:
+        if not _user_agents:
+            from faker import Faker
+            faker = Faker()
+            _user_agents.extend(faker.user_agent() for _ in range(16))
+    return random.choice(_user_agents)
+
+def get_session(kind: str = "internet") -> "requests.Session":
+    """
+    Get a shared http session, created on first use. The connections are kept alive in a pool per host.
+
+    Arguments:
+        kind (str): "internet" for the mirrors and the GitHub API, which honours the proxy environment variables;
+            "local" for the services on this machine, such as the controller API, which ignores them.
+    """
+    with _sessions_lock:
+        if kind not in _sessions:
+            session = requests.Session()
+            if kind == "internet":
+                # many mirror hosts, several connections to the same host when racing or downloading segments
+                adapter = requests_adapters.HTTPAdapter(pool_connections=64, pool_maxsize=8)
+            elif kind == "local":
+                adapter = requests_adapters.HTTPAdapter(pool_connections=8, pool_maxsize=4)
+                session.trust_env = False
+            else:
+                raise ValueError(f"Unknown session kind: {kind}")
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[kind] = session
+        return _sessions[kind]
+
+def _open_fastest(
+    candidates: List[Tuple[int, str]],
+    open_url: Callable[[str], "requests.Response"],
+    race: int,
+) -> Tuple[Optional[Tuple[int, str, "requests.Response"]], List[Tuple[int, str]]]:
+    """
+    Open the candidate urls with at most `race` attempts in flight, and keep the first one that
+    returns a valid response. The remaining attempts are cancelled: attempts that have not started
+    are dropped, and responses that arrive late are closed immediately.
+
+    Daemon threads are used instead of a thread pool, so that a blackholed mirror stuck in connect
+    never delays the interpreter exit.
+
+    Returns:
+        winner: The (idx, url, response) of the first valid response, or None if all the urls failed.
+        failed: The (idx, url) of the candidates that failed.
+    """
+    results: "queue.Queue[Tuple[int, str, Optional[requests.Response]]]" = queue.Queue()
+    lock = threading.Lock()
+    cancelled = False
+
+    def attempt(idx: int, url: str) -> None:
+        try:
+            response = open_url(url)
+        except Exception as e:
+            # any failure must still be reported, or the caller waits on the queue forever
+            if not isinstance(e, requests.exceptions.RequestException):
+                logger.warn(f"Unexpected error from {url}: {e!r}")
+            response = None
+
+        with lock:
+            if cancelled and response is not None:
+                response.close()
+            else:
+                results.put((idx, url, response))
+
+    pending = iter(candidates)
+    running = 0
+    failed = []
+
+    def launch() -> bool:
+        for idx, url in pending:
+            threading.Thread(target=attempt, args=(idx, url), daemon=True).start()
+            return True
+        return False
+
+    for _ in range(max(1, race)):
+        running += launch()
+
+    while running:
+        idx, url, response = results.get()
+        running -= 1
+
+        if response is not None:
+            with lock:
+                cancelled = True
+                while not results.empty():
+                    _, _, late = results.get_nowait()
+                    if late is not None:
+                        late.close()
+            return (idx, url, response), failed
+
+        logger.warn(f"Failed to download from {url}")
+        failed.append((idx, url))
+        running += launch()
+
+    return None, failed
+
+class Transform:
+    """
+    An incremental transform of a download stream. ``feed`` takes the next chunk of the response and returns
+    the bytes to write, ``flush`` returns the remaining bytes at the end of the stream.
+    """
+    def feed(self, chunk: bytes) -> bytes:
+        raise NotImplementedError
+
+    def flush(self) -> bytes:
+        raise NotImplementedError
+
+
+class Gunzip(Transform):
+    """
+    Decompress a gzip stream chunk by chunk.
+    """
+    def __init__(self) -> None:
+        self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def feed(self, chunk: bytes) -> bytes:
+        try:
+            return self._decoder.decompress(chunk)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip stream: {e}") from e
+
+    def flush(self) -> bytes:
+        data = self._decoder.flush()
+        if not self._decoder.eof:
+            raise ValueError("Truncated gzip stream")
+        return data
+
+
+def _staging_path(path: Path) -> Path:
+    """
+    A hidden sibling of the path, to be renamed to the path once it is completely written.
+    """
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+class PartialDownload:
+    """
+    The state of a resumable download. The received bytes are kept in ``<path>.part``, and a sidecar
+    ``<path>.part.json`` keeps the validators of the response (ETag / Last-Modified), the total length,
+    and for a segmented download the byte ranges that are still missing.
+    """
+    # minimum size of a segment (bytes)
+    min_segment = 1 << 20
+
+    def __init__(self, path: Path) -> None:
+        self.part = path.with_name(path.name + ".part")
+        self.meta_path = path.with_name(path.name + ".part.json")
+        self.meta: dict = {}
+
+        try:
+            with open(self.meta_path, "r") as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {}
+
+        # a part without a sidecar cannot be trusted, and vice versa
+        if not self.meta or not self.part.exists():
+            self.reset()
+
+    @property
+    def offset(self) -> int:
+        """
+        The number of bytes received for a plain download.
+        """
+        if not self.meta or "segments" in self.meta or not self.part.exists():
+            return 0
+        return self.part.stat().st_size
+
+    def headers(self, url: str) -> Dict[str, str]:
+        """
+        The headers to resume the download from the given url.
+        """
+        offset = self.offset
+        if offset == 0:
+            return {}
+
+        headers = {"Range": f"bytes={offset}-"}
+        # validators are only comparable on the same host; other mirrors are checked by the total length
+        validator = self.meta.get("etag") or self.meta.get("last_modified")
+        if validator and MirrorScoreboard.host(url) == MirrorScoreboard.host(self.meta.get("url", "")):
+            headers["If-Range"] = validator
+        return headers
+
+    def accept(self, url: str, r: "requests.Response") -> int:
+        """
+        Check a response against the saved state, and return the offset to write its body at.
+        Raise a RequestException if the response cannot be used.
+        """
+        offset = 0
+        total = None
+        if r.status_code == 206:
+            match = re.match(r"^bytes (\d+)-(\d+)/(\d+)$", r.headers.get("Content-Range", ""))
+            if match is None or int(match.group(1)) != self.offset:
+                self.reset()
+                raise requests.exceptions.RequestException(f"Unexpected range from {url}")
+            offset, total = int(match.group(1)), int(match.group(3))
+        elif "Content-Length" in r.headers:
+            total = int(r.headers["Content-Length"])
+
+        if offset and total != self.meta.get("length"):
+            self.reset()
+            raise requests.exceptions.RequestException(f"Mismatched length from {url}")
+
+        # a segmented download keeps its segments as long as the file is the same
+        if "segments" in self.meta and total == self.meta.get("length"):
+            return 0
+
+        if offset == 0:
+            self.reset()
+
+        # offsets are only meaningful without a content encoding
+        resumable = (
+            total is not None
+            and r.headers.get("Content-Encoding", "identity") == "identity"
+            and (r.status_code == 206 or r.headers.get("Accept-Ranges") == "bytes")
+        )
+        if resumable and offset == 0:
+            self.meta = {
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "length": total,
+            }
+            self.save()
+
+        return offset
+
+    def plan(self, segments: int) -> bool:
+        """
+        Split a fresh download into segments. Return whether the download is segmented.
+        """
+        if "segments" in self.meta:
+            return True
+
+        length = self.meta.get("length")
+        if segments <= 1 or length is None or length < 2 * self.min_segment:
+            return False
+
+        segments = min(segments, length // self.min_segment)
+        bounds = [length * i // segments for i in range(segments + 1)]
+        self.meta["segments"] = [[bounds[i], bounds[i + 1] - 1, bounds[i]] for i in range(segments)]
+        with open(self.part, "wb") as f:
+            f.truncate(length)
+        self.save()
+        return True
+
+    def save(self) -> None:
+        with open(self.meta_path, "w") as f:
+            json.dump(self.meta, f)
+
+    def reset(self) -> None:
+        self.meta = {}
+        self.part.unlink(missing_ok=True)
+        self.meta_path.unlink(missing_ok=True)
+
+    def finish(self, path: Path, write_callback = None, transform: Optional[Callable[[], "Transform"]] = None) -> None:
+        """
+        Move the completed part to the target path, passing it through the transform or the write callback if given.
+        """
+        if transform is not None or write_callback:
+            staging = _staging_path(path)
+            try:
+                with open(self.part, "rb") as src, open(staging, "wb") as tgt:
+                    if transform is not None:
+                        decoder = transform()
+                        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                            tgt.write(decoder.feed(chunk))
+                        tgt.write(decoder.flush())
+                    else:
+                        write_callback(src, tgt)
+                os.replace(staging, path)
+            finally:
+                staging.unlink(missing_ok=True)
+            self.part.unlink()
+        else:
+            os.replace(self.part, path)
+        self.meta_path.unlink(missing_ok=True)
+        self.meta = {}
+
+
+def _download_segments(
+    urls: List[str],
+    state: PartialDownload,
+    open_range: Callable[[str, int, int], "requests.Response"],
+    advance: Callable[[int], None],
+) -> None:
+    """
+    Download the missing segments of a part file in parallel. Each segment starts from a different
+    mirror, and moves on to the next mirror if its mirror fails.
+    """
+    errors = []
+    length = state.meta["length"]
+
+    def worker(i: int, segment: List[int]) -> None:
+        for url in urls[i % len(urls):] + urls[:i % len(urls)]:
+            start, end, pos = segment
+            if pos > end:
+                return
+            try:
+                with open_range(url, pos, end) as r:
+                    match = re.match(r"^bytes (\d+)-(\d+)/(\d+)$", r.headers.get("Content-Range", ""))
+                    if r.status_code != 206 or match is None or int(match.group(1)) != pos:
+                        raise requests.exceptions.RequestException(f"Range not supported by {url}")
+                    # a mirror serving another version of the file would corrupt the part
+                    if int(match.group(3)) != length:
+                        raise requests.exceptions.RequestException(f"Mismatched length from {url}")
+                    with open(state.part, "r+b") as f:
+                        f.seek(pos)
+                        for chunk in r.iter_content(chunk_size = CHUNK_SIZE):
+                            chunk = chunk[:end + 1 - segment[2]]
+                            f.write(chunk)
+                            segment[2] += len(chunk)
+                            advance(len(chunk))
+                            if segment[2] > end:
+                                break
+                if segment[2] > end:
+                    return
+            except requests.exceptions.RequestException:
+                mirrors.record(url, ok=False)
+                logger.warn(f"Failed to download segment {start}-{end} from {url}")
+            except Exception as e:
+                # not the fault of the mirror, e.g. a local write error, so do not try the others
+                logger.error(f"Failed to download segment {start}-{end}: {e!r}")
+                break
+        errors.append(i)
+
+    threads = [
+        threading.Thread(target=worker, args=(i, segment), daemon=True)
+        for i, segment in enumerate(state.meta["segments"])
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    finally:
+        state.save()
+
+    if errors or not all(end < pos for _, end, pos in state.meta["segments"]):
+        raise requests.exceptions.RequestException("Failed to download all segments")
+
+# the progress display shared by the downloads of every thread, see `shared_progress`
+_shared_progress: Optional["rich.progress.Progress"] = None
+
+def make_progress(transient: bool = True) -> "rich.progress.Progress":
+    """
+    Create the progress display of the downloads. Each download is a row with its ``filename`` and ``idx`` fields.
+
+    A row with the ``status`` field set shows the status of a whole job instead, e.g. the update of an
+    environment, and leaves the transfer columns empty.
+    """
+    from rich.progress import (
+        BarColumn,
+        DownloadColumn,
+        Progress,
+        ProgressColumn,
+        TextColumn,
+        TimeRemainingColumn,
+        TransferSpeedColumn,
+    )
+
+    class TransferColumn(ProgressColumn):
+        def __init__(self, column: ProgressColumn) -> None:
+            super().__init__()
+            self.column = column
+
+        def render(self, task: "rich.progress.Task"):
+            return "" if "status" in task.fields else self.column.render(task)
+
+    columns = [
+        "[progress.percentage]{task.percentage:>3.1f}%", "•", DownloadColumn(), "•", TransferSpeedColumn(), "•",
+        TimeRemainingColumn(),
+    ]
+    return Progress(
+        TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
+        TextColumn("[bold green]({task.fields[idx]})[/bold green]", justify="right"),
+        BarColumn(bar_width=None),
+        *[TransferColumn(TextColumn(column) if isinstance(column, str) else column) for column in columns],
+        transient=transient,
+        # use logger console
+        console=logger.console,
+    )
+
+@contextmanager
+def shared_progress() -> Iterator["rich.progress.Progress"]:
+    """
+    Show the downloads of every thread in one progress display, instead of one display per download,
+    which rich does not allow at the same time. The display stays on the screen after the context exits.
+    """
+    global _shared_progress
+    progress = make_progress(transient=False)
+    with progress:
+        _shared_progress = progress
+        try:
+            yield progress
+        finally:
+            _shared_progress = None
+
 def download_file(
     urls: Union[str, List[str]],
     path: Union[str, Path],
     desc: str = "Downloading...",
     timeout: Union[int, Tuple[int, int]] = (15, 180),
     write_callback = None,
-):
+    race: int = 4,
+    segments: int = 1,
+    transform: Optional[Callable[[], Transform]] = None,
+    validators: Optional[Dict[str, Optional[str]]] = None,
+) -> Optional[Dict[str, Optional[str]]]:
     """
     Download a file from the internet. If the file already exists, it will skip the download.
-    If the url is blocked, then try the next one.
+    Up to `race` urls are requested in parallel, the first valid response is kept and the rest are cancelled.
+    If the download fails halfway, then race the remaining urls again.
 
-    write_callback should be a function with the source and target file descriptors as input.
-    """
-    if not isinstance(urls, list):
-        urls = [urls]
+    The received bytes are kept in `<path>.part`, so a failed download resumes with an HTTP Range request,
+    from the next mirror or in the next call. If segments > 1, large files are split into byte ranges that
+    are downloaded in parallel from different mirrors.
+
+    transform is a factory of `Transform`, e.g. `Gunzip`. The response is decoded chunk by chunk and written
+    straight into the target, so the memory usage does not grow with the file size; a segmented or resumed
+    download is decoded from its part file in the same way. The target is always written under a temporary
+    name and renamed, so it never exists half-written.
 
+    write_callback should be a function with the source and target file descriptors as input. Prefer transform.
+    Set race to 1 to try the urls one by one.
+
+    validators are the ``url``, ``etag`` and ``last_modified`` returned by a previous download of the same file.
+    They are sent as If-None-Match / If-Modified-Since to the same host, and if the file is not modified, nothing
+    is written and None is returned. Otherwise the validators of this download are returned.
+    """
     # apply proxy if it matches the pattern
-    updated_urls = []
-    for url in urls:
-        updated_urls.append(url)
-        for rule in PROXY_RULES:
-            pattern, replacements = rule
-            if re.match(pattern, url):
-                for replacement in replacements:
-                    updated_url = re.sub(pattern, replacement, url)
-                    updated_urls.append(updated_url)
-                break
-    urls = updated_urls
+    urls = mirrors.sort(expand_urls(urls))
 
     if isinstance(path, str):
         path = Path(path)
 
     if path.exists():
-        return
+        return {"url": None, "etag": None, "last_modified": None}
 
-    progress = Progress(
-        TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
-        TextColumn(f"[bold green]({{task.fields[idx]}} / {len(urls)})[/bold green]", justify="right"),
-        BarColumn(bar_width=None),
-        "[progress.percentage]{task.percentage:>3.1f}%",
-        "•",
-        DownloadColumn(),
-        "•",
-        TransferSpeedColumn(),
-        "•",
-        TimeRemainingColumn(),
+    state = PartialDownload(path)
 
-        # do not leave the progress bar hanging
-        transient=True,
-        # use logger console
-        console=logger.console
-    )
+    def get(url: str, headers: Dict[str, str]) -> "requests.Response":
+        headers = {"User-Agent": user_agent(), **headers}
+        start = time.time()
+        try:
+            r = get_session().get(url, headers=headers, stream=True, timeout=timeout)
+        except requests.exceptions.RequestException:
+            mirrors.record(url, ok=False)
+            raise
+        try:
+            r.raise_for_status()
+        except requests.exceptions.RequestException:
+            r.close()
+            mirrors.record(url, ok=False)
+            raise
+        mirrors.record(url, ok=True, ttfb=time.time() - start)
+        return r
 
-    with progress:
+    def open_url(url: str) -> "requests.Response":
+        headers = state.headers(url)
+        # a resumed download is already conditional, with If-Range
+        if not headers and validators and MirrorScoreboard.host(url) == MirrorScoreboard.host(validators.get("url") or ""):
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        return get(url, headers)
+
+    def open_range(url: str, start: int, end: int) -> "requests.Response":
+        return get(url, {"Range": f"bytes={start}-{end}"})
+
+    if _shared_progress is not None:
+        progress, display = _shared_progress, nullcontext()
+    else:
+        progress = display = make_progress()
+
+    with display:
         logger.info(desc)
-        for idx, url in enumerate(urls):
-            task = progress.add_task("download", filename=path.name, idx=str(idx + 1), start=False)
+        candidates = list(enumerate(urls))
+        while candidates:
+            winner, failed = _open_fastest(candidates, open_url, race)
+            candidates = [c for c in candidates if c not in failed]
+            if winner is None:
+                continue
 
-            try:
-                headers = {"User-Agent": Faker().user_agent()}
-                r = requests.get(url, headers=headers, stream=True, timeout=timeout)
-                progress.update(task, total=int(r.headers.get('Content-Length', 0)))
+            idx, url, r = winner
+            candidates.remove((idx, url))
+            if r.status_code == 304:
+                r.close()
+                logger.info(f"Not modified: {path.name}")
+                return None
+
+            task = progress.add_task("download", filename=path.name, idx=f"{idx + 1} / {len(urls)}", start=False)
 
-                with tempfile.TemporaryFile("w+b") as tmp:
-                    # download to tmp dir
+            try:
+                with r:
+                    offset = state.accept(url, r)
+                    total = state.meta.get("length", int(r.headers.get('Content-Length', 0)) + offset)
+                    progress.update(task, total=total)
                     progress.start_task(task)
-                    for chunk in r.iter_content(chunk_size = 1024):
-                        if chunk:
-                            tmp.write(chunk)
-                            progress.update(task, advance=len(chunk))
-
-                    tmp.seek(0)
-                    # move to home
-                    with open(path, "wb") as f:
-                        if write_callback:
-                            write_callback(tmp, f)
-                        else:
-                            f.write(tmp.read())
-
-                    logger.info(f"Download completed: {path}")
-                break
+
+                    if state.plan(segments):
+                        # the winner only proves the file is reachable, fetch the segments from all mirrors
+                        r.close()
+                        done = sum(pos - start for start, _, pos in state.meta["segments"])
+                        progress.update(task, completed=done)
+                        _download_segments(
+                            [url] + [u for _, u in candidates],
+                            state,
+                            open_range,
+                            lambda n: progress.update(task, advance=n),
+                        )
+                    else:
+                        # unless we are resuming a part, stream through the transform straight into the target
+                        direct = transform is not None and offset == 0
+                        if direct:
+                            state.reset()
+                        out = _staging_path(path) if direct else state.part
+
+                        progress.update(task, completed=offset)
+                        start, size = time.time(), 0
+                        try:
+                            try:
+                                with open(out, "r+b" if offset else "wb") as f:
+                                    f.seek(offset)
+                                    decoder = transform() if direct else None
+                                    for chunk in r.iter_content(chunk_size = CHUNK_SIZE):
+                                        if chunk:
+                                            f.write(decoder.feed(chunk) if decoder else chunk)
+                                            size += len(chunk)
+                                            progress.update(task, advance=len(chunk))
+                                    if decoder:
+                                        f.write(decoder.flush())
+                            except requests.exceptions.RequestException:
+                                mirrors.record(url, ok=False)
+                                raise
+                            except ValueError as e:
+                                # a truncated or corrupted stream, the next mirror may serve a good one
+                                mirrors.record(url, ok=False)
+                                raise requests.exceptions.RequestException(f"Invalid content from {url}: {e}") from e
+                            mirrors.record(url, ok=True, speed=size / max(time.time() - start, 1e-3))
+
+                            if "length" in state.meta and state.part.stat().st_size != state.meta["length"]:
+                                raise requests.exceptions.RequestException(f"Incomplete download from {url}")
+
+                            if direct:
+                                os.replace(out, path)
+                        finally:
+                            # the staging file is gone once renamed into place
+                            if direct:
+                                out.unlink(missing_ok=True)
+
+                # move to home
+                if not path.exists():
+                    state.finish(path, write_callback, transform)
+                logger.info(f"Download completed: {path}")
+                progress.remove_task(task)
+                return {"url": url, "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
             except requests.exceptions.RequestException:
                 progress.remove_task(task)
                 logger.warn(f"Failed to download from {url}")
-        else:
-            logger.error("All urls are blocked")
-            raise requests.exceptions.RequestException("All urls are blocked")
+
+        logger.error("All urls are blocked")
+        raise requests.exceptions.RequestException("All urls are blocked")
 
 def runbg(command: List[str]) -> int:
     """
@@ -458,7 +1174,7 @@ def runbg(command: List[str]) -> int:
     )
     return p.pid
 
-def get_process(pid: Optional[int] = None) -> Union[psutil.Process, None]:
+def get_process(pid: Optional[int] = None) -> Union["psutil.Process", None]:
     """
     Get a process object by pid.
     If pid is None, get the current process.
@@ -471,40 +1187,107 @@ def get_process(pid: Optional[int] = None) -> Union[psutil.Process, None]:
     except psutil.NoSuchProcess:
         return None
 
-def get_latest_github_release(repo: str, filename: str) -> Optional[str]:
+class ReleaseCache:
+    """
+    An on-disk cache of the latest GitHub releases, stored as a json file under WORK_DIR.
+
+    Each repository keeps the download urls of its assets, the ETag of the response and the time it was
+    fetched. Fresh entries skip the GitHub API, expired entries are revalidated with If-None-Match, and
+    stale entries are still served if the GitHub API is not reachable.
+    """
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        if self._path is not None:
+            return self._path
+        from slash.core import constants
+        return constants.WORK_DIR / "releases.json"
+
+    def get(self, repo: str) -> Optional[dict]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f).get(repo)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, repo: str, entry: dict) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with filelock.SoftFileLock(self.path.with_suffix(".lock")):
+                try:
+                    with open(self.path, "r") as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    data = {}
+                data[repo] = entry
+                with tempfile.NamedTemporaryFile("w", dir=self.path.parent, delete=False) as f:
+                    json.dump(data, f)
+                os.replace(f.name, self.path)
+        except OSError as e:
+            logger.warn(f"Failed to cache the release of {repo}: {e}")
+
+releases = ReleaseCache()
+
+# default time to live of the cached releases (seconds)
+RELEASE_CACHE_TTL = 6 * 60 * 60
+
+def get_latest_github_release(repo: str, filename: str, ttl: Optional[float] = None) -> Optional[str]:
     """
     Get the latest release download link for a file from a GitHub repository.
     Returns the download URL if available, otherwise None.
+
+    The releases are cached on disk for ttl seconds (default RELEASE_CACHE_TTL). An expired release is
+    revalidated with a conditional request, and is still used if all the API mirrors fail.
     """
-    def get_download_url(url: str, filename: str) -> Optional[str]:
+    if ttl is None:
+        ttl = RELEASE_CACHE_TTL
+
+    cached = releases.get(repo)
+    if cached is not None and time.time() - cached["time"] < ttl and filename in cached["assets"]:
+        return cached["assets"][filename]
+
+    headers = {}
+    if cached is not None and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+
+    def get_release(url: str) -> Optional[dict]:
+        start = time.time()
         try:
-            response = requests.get(url)
+            response = get_session().get(url, headers=headers, timeout=(15, 60))
             response.raise_for_status()
-            data = response.json()
-            for asset in data.get('assets', []):
-                # if asset['name'] == filename:
-                if re.match(rf"^{re.escape(filename)}$", asset['name']):
-                    return asset['browser_download_url']
-        except requests.RequestException as e:
+            if response.status_code == 304 and cached is not None:
+                entry = {**cached, "time": time.time()}
+            else:
+                data = response.json()
+                entry = {
+                    "etag": response.headers.get("ETag"),
+                    "time": time.time(),
+                    "assets": {asset['name']: asset['browser_download_url'] for asset in data.get('assets', [])},
+                }
+        except (requests.RequestException, KeyError, TypeError, AttributeError) as e:
+            mirrors.record(url, ok=False)
             logger.warn(f"Failed to fetch latest release: {e}")
-        return None
+            return None
+
+        mirrors.record(url, ok=True, ttfb=time.time() - start)
+        return entry
 
     url = f"https://api.github.com/repos/{repo}/releases/latest"
 
     # apply proxy
-    updated_urls = [url]
-    for rule in PROXY_RULES:
-        pattern, replacements = rule
-        if re.match(pattern, url):
-            for replacement in replacements:
-                updated_url = re.sub(pattern, replacement, url)
-                updated_urls.append(updated_url)
-            break
-
-    for url in updated_urls:
-        download_url = get_download_url(url, filename)
-        if download_url:
-            return download_url
+    for url in mirrors.sort(expand_urls(url)):
+        entry = get_release(url)
+        if entry is not None and filename in entry["assets"]:
+            releases.put(repo, entry)
+            return entry["assets"][filename]
+
+    # stale while revalidate
+    if cached is not None and filename in cached["assets"]:
+        fetched = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cached["time"]))
+        logger.warn(f"Failed to refresh the latest release of {repo}, use the one fetched at {fetched}")
+        return cached["assets"][filename]
 
     logger.error(f"No download URL found for {filename} in {repo}")
     return None
@@ -0,0 +1,69 @@
+import io
+import shutil
+import tarfile
+import unittest
+from unittest import mock
+
+from slash.core import bundle
+from slash.core.store import ArtifactStore
+
+from .test_common import TesterMixin
+
+
+class TestBundle(TesterMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = ArtifactStore()
+        self.artifacts = {
+            "https://example.com/binary#gunzip": (b"\x7fELF binary", 0o544),
+            "https://example.com/geoip.metadb": (b"geoip", 0o444),
+            "https://example.com/same-content": (b"geoip", 0o444),
+        }
+
+        def fetcher(key):
+            content, mode = self.artifacts[key]
+            def fetch():
+                path = self._temp_dir_path / "download"
+                with open(path, "wb") as f:
+                    f.write(content)
+                return self.store.put(key, path, mode=mode)
+            return fetch
+
+        patch = mock.patch.dict(bundle.ARTIFACTS, {key: fetcher(key) for key in self.artifacts}, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_roundtrip(self):
+        path = bundle.export_bundle(self._temp_dir_path / "bundle.tar.gz")
+        shutil.rmtree(self.store.root)
+
+        self.assertEqual(bundle.import_bundle(path), 3)
+        for key, (content, mode) in self.artifacts.items():
+            blob = self.store.get(key)
+            self.assertIsNotNone(blob)
+            with open(blob, "rb") as f:
+                self.assertEqual(f.read(), content)
+            self.assertEqual(blob.stat().st_mode & 0o777, mode)
+            # the imported copies do not expire, the node may never download them again
+            self.assertEqual(self.store.get(key, max_age=-1), blob)
+
+    def test_corrupted(self):
+        path = bundle.export_bundle(self._temp_dir_path / "bundle.tar.gz")
+        shutil.rmtree(self.store.root)
+
+        # rewrite the bundle with a tampered blob
+        tampered = self._temp_dir_path / "tampered.tar.gz"
+        with tarfile.open(path, "r:gz") as src, tarfile.open(tampered, "w:gz") as dst:
+            for member in src:
+                data = src.extractfile(member).read()
+                if member.name.startswith("blobs/"):
+                    data = data[::-1]
+                member.size = len(data)
+                dst.addfile(member, io.BytesIO(data))
+
+        with self.assertRaises(ValueError):
+            bundle.import_bundle(tampered)
+
+
+if __name__ == "__main__":
+    unittest.main()
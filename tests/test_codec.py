@@ -0,0 +1,82 @@
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from slash.core.codec import ConfigSnapshot, YamlCodec
+
+
+class TestYamlCodec(unittest.TestCase):
+    def test_safe(self):
+        codec = YamlCodec("safe")
+        config = {"port": 7890, "proxies": [{"name": "香港 01", "udp": True}], "rules": ["MATCH,DIRECT"]}
+        stream = io.StringIO()
+        codec.dump(config, stream)
+        self.assertIn("香港 01", stream.getvalue())
+        self.assertNotIn("{", stream.getvalue()) # block style
+        self.assertEqual(codec.load(io.StringIO(stream.getvalue())), config)
+
+        # YAML 1.2, these stay strings
+        self.assertEqual(codec.load(io.StringIO("a: no\nb: on\n")), {"a": "no", "b": "on"})
+
+    def test_errors(self):
+        codec = YamlCodec("safe")
+        with self.assertRaises(codec.errors):
+            codec.load(io.StringIO("proxies: [a, b\n"))
+
+    def test_roundtrip(self):
+        codec = YamlCodec("rt")
+        text = "# a comment\nhttp_server: 127.0.0.1 # the server\n"
+        stream = io.StringIO()
+        codec.dump(codec.load(io.StringIO(text)), stream)
+        self.assertEqual(stream.getvalue(), text)
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = Path(temp_dir.name) / "config.yaml"
+        self.codec = YamlCodec("safe")
+        self.snapshot = ConfigSnapshot(self.path, self.codec)
+
+    def load(self):
+        with mock.patch.object(self.codec, "load", wraps=self.codec.load) as load:
+            content = self.snapshot.load()
+        return content, load.call_count
+
+    def test_load(self):
+        with open(self.path, "w") as f:
+            f.write("port: 7890\nrules: ['MATCH,DIRECT']\n")
+        config = {"port": 7890, "rules": ["MATCH,DIRECT"]}
+
+        self.assertEqual(self.load(), (config, 1))
+        self.assertTrue(self.snapshot.snapshot_path.exists())
+        # parsed only once
+        self.assertEqual(self.load(), (config, 0))
+
+        # same size and mtime, different content
+        st = self.path.stat()
+        with open(self.path, "w") as f:
+            f.write("port: 7891\nrules: ['MATCH,DIRECT']\n")
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(self.load(), (dict(config, port=7891), 1))
+
+        # a corrupted snapshot is taken again
+        with open(self.snapshot.snapshot_path, "wb") as f:
+            f.write(b"garbage")
+        self.assertEqual(self.load(), (dict(config, port=7891), 1))
+        self.assertEqual(self.load(), (dict(config, port=7891), 0))
+
+    def test_dump(self):
+        config = {"port": 7890, "proxies": [{"name": "香港 01"}]}
+        self.snapshot.dump(config)
+        self.assertEqual(self.load(), (config, 0))
+        with open(self.path, "r") as f:
+            self.assertEqual(self.codec.load(f), config)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import base64
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from slash.core import converter
+from slash.core.codec import ConfigSnapshot, config_codec
+
+
+def b64(text: str) -> str:
+    return base64.b64encode(text.encode()).decode()
+
+
+class TestParseUri(unittest.TestCase):
+    def test_ss(self):
+        proxy = converter.parse_uri(f"ss://{b64('aes-256-gcm:pass')}@1.2.3.4:8388?plugin=obfs-local%3Bobfs%3Dtls%3Bobfs-host%3Da.com#HK%2001")
+        self.assertEqual(proxy, {
+            "name": "HK 01", "type": "ss", "server": "1.2.3.4", "port": 8388, "cipher": "aes-256-gcm", "password": "pass",
+            "udp": True, "plugin": "obfs", "plugin-opts": {"mode": "tls", "host": "a.com"},
+        })
+        # the legacy format, without a name
+        proxy = converter.parse_uri(f"ss://{b64('chacha20-ietf-poly1305:p@ss:w@example.com:443')}")
+        self.assertEqual((proxy["name"], proxy["password"], proxy["server"]), ("example.com:443", "p@ss:w", "example.com"))
+
+    def test_ssr(self):
+        uri = f"ssr://{b64('1.2.3.4:443:auth_aes128_md5:aes-128-ctr:tls1.2_ticket_auth:' + b64('pass') + '/?remarks=' + b64('日本'))}"
+        proxy = converter.parse_uri(uri)
+        self.assertEqual(
+            (proxy["name"], proxy["port"], proxy["protocol"], proxy["cipher"], proxy["obfs"], proxy["password"]),
+            ("日本", 443, "auth_aes128_md5", "aes-128-ctr", "tls1.2_ticket_auth", "pass"),
+        )
+
+    def test_vmess(self):
+        data = {"ps": "US", "add": "a.com", "port": "443", "id": "uuid", "aid": "0", "net": "ws", "path": "/ws", "host": "b.com", "tls": "tls", "sni": "b.com"}
+        proxy = converter.parse_uri(f"vmess://{b64(json.dumps(data))}")
+        self.assertEqual(proxy, {
+            "name": "US", "type": "vmess", "server": "a.com", "port": 443, "uuid": "uuid", "alterId": 0, "cipher": "auto",
+            "udp": True, "tls": True, "servername": "b.com", "network": "ws", "ws-opts": {"path": "/ws", "headers": {"Host": "b.com"}},
+        })
+
+    def test_vless_trojan_hysteria2(self):
+        proxy = converter.parse_uri("vless://uuid@a.com:443?security=reality&sni=b.com&pbk=key&sid=01&type=grpc&serviceName=svc&flow=xtls-rprx-vision#SG")
+        self.assertEqual(proxy["reality-opts"], {"public-key": "key", "short-id": "01"})
+        self.assertEqual(proxy["grpc-opts"], {"grpc-service-name": "svc"})
+        self.assertEqual((proxy["uuid"], proxy["flow"], proxy["servername"]), ("uuid", "xtls-rprx-vision", "b.com"))
+
+        proxy = converter.parse_uri("trojan://pass@a.com:443?sni=b.com&allowInsecure=1#TW")
+        self.assertEqual((proxy["password"], proxy["sni"], proxy["skip-cert-verify"]), ("pass", "b.com", True))
+
+        proxy = converter.parse_uri("hy2://pa:ss@a.com:8443?obfs=salamander&obfs-password=x#KR")
+        self.assertEqual((proxy["type"], proxy["password"], proxy["port"], proxy["obfs"]), ("hysteria2", "pa:ss", 8443, "salamander"))
+
+    def test_invalid(self):
+        for uri in ["http://a.com", "vmess://not-json", "trojan://pass@:443", "ss://YWVz@a.com:port"]:
+            with self.assertRaises(ValueError, msg=uri):
+                converter.parse_uri(uri)
+
+
+class TestConvert(unittest.TestCase):
+    LINKS = [
+        f"ss://{b64('aes-256-gcm:pass')}@1.2.3.4:8388#Node",
+        "trojan://pass@a.com:443#Node",
+        "hysteria2://pass@b.com:443#Other",
+    ]
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = Path(temp_dir.name)
+
+    def test_formats(self):
+        plain = "\n".join(self.LINKS).encode()
+        # base64 with line breaks and without padding, read in small chunks
+        encoded = base64.urlsafe_b64encode(plain).rstrip(b"=")
+        encoded = b"\n".join(encoded[i:i + 7] for i in range(0, len(encoded), 7))
+        with mock.patch.object(converter, "CHUNK_SIZE", 5):
+            for data in [plain, encoded]:
+                names = [proxy["name"] for proxy in converter.iter_proxies(io.BytesIO(data))]
+                self.assertEqual(names, ["Node", "Node", "Other"])
+
+        # an unsupported link is not dropped silently
+        with self.assertRaises(ValueError):
+            list(converter.iter_proxies(io.BytesIO(plain + b"\nunknown://node")))
+
+        clash = b"port: 7890\nproxies:\n  - {name: A, type: ss, server: a.com, port: 1, cipher: none, password: x}\n"
+        self.assertEqual([proxy["name"] for proxy in converter.iter_proxies(io.BytesIO(clash))], ["A"])
+
+        with self.assertRaises(ValueError):
+            list(converter.iter_proxies(io.BytesIO(b"<html>blocked</html>")))
+
+    def test_convert(self):
+        sub = self.path / "sub"
+        sub.write_text(b64("\n".join(self.LINKS)))
+        tgt = converter.convert(sub, self.path / "config.yaml")
+
+        with open(tgt, "r") as f:
+            config = config_codec.load(f)
+        names = ["Node", "Node 2", "Other"]
+        self.assertEqual([proxy["name"] for proxy in config["proxies"]], names)
+        self.assertEqual(config["proxy-groups"][0]["proxies"], ["Auto", "DIRECT", *names])
+        self.assertEqual(config["proxy-groups"][1]["proxies"], names)
+        self.assertEqual(config["rules"][-1], "MATCH,Select")
+
+        # the snapshot is taken on the way
+        with mock.patch.object(config_codec, "load") as load:
+            self.assertEqual(ConfigSnapshot(tgt, config_codec).load(), config)
+            load.assert_not_called()
+
+        # no proxy is dropped silently
+        for links in [["unknown://only"], [*self.LINKS, "unknown://node"]]:
+            sub.write_text("\n".join(links))
+            with self.assertRaises(ValueError):
+                converter.convert(sub, self.path / "config.yaml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,24 @@
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
 import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from unittest import mock
 
+import psutil
+import requests
 from ruamel.yaml import YAML
 
+from slash.core import envs
 from slash.core.config import SlashConfig
 from slash.core.envs import Env
 
@@ -136,6 +150,376 @@ class TestEnv(TesterMixin, unittest.TestCase):
         config = SlashConfig(http_server="172.168.1.1", http_port=1234)
         self.assertTrue(self.env.set_dialer_proxy(config))
 
+    def test_env_edit_config(self):
+        env = Env(name="test_env")
+        self.assertTrue(env.update())
+
+        with mock.patch.object(env, "_get_config", wraps=env._get_config) as get_config, \
+             mock.patch.object(env, "_set_config", wraps=env._set_config) as set_config:
+            with env.edit_config():
+                env.set_port(1234)
+                secret = env.set_controller(port=5678, local_only=True)
+                self.assertTrue(env.set_dialer_proxy(SlashConfig(http_server="172.168.1.1", http_port=1234)))
+            self.assertEqual(get_config.call_count, 1)
+            self.assertEqual(set_config.call_count, 1)
+
+        config = env._get_config()
+        self.assertEqual(config["port"], 1234)
+        self.assertEqual(config["external-controller"], "127.0.0.1:5678")
+        self.assertEqual(config["secret"], secret)
+        self.assertEqual(config["proxies"][0]["name"], "direct")
+
+        # nothing is written if the transaction fails
+        with self.assertRaises(RuntimeError):
+            with env.edit_config():
+                env.set_port(4321)
+                raise RuntimeError()
+        self.assertEqual(env._get_config()["port"], 1234)
+        self.assertEqual(sorted(path.name for path in env.workdir.iterdir()), [".config.yaml.snapshot", "config.yaml", "env.json"])
+
+    def test_env_config_snapshot(self):
+        env = Env(name="test_env")
+        self.assertTrue(env.update())
+
+        # the config written by update and by the setters is never parsed again
+        with mock.patch.object(env.codec, "load", wraps=env.codec.load) as load:
+            env.set_port(1234)
+            self.assertEqual(env._get_config()["port"], 1234)
+            self.assertEqual(load.call_count, 0)
+
+
+class SubscriptionHandler(BaseHTTPRequestHandler):
+    # set by the tests: the body, its etag, and the headers of the requests received
+    body = b""
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestEnvConditionalUpdate(TesterMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        server = ThreadingHTTPServer(("127.0.0.1", 0), SubscriptionHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        SubscriptionHandler.body, SubscriptionHandler.etag, SubscriptionHandler.requests = b"name: node\n", '"v1"', []
+
+        geoip = self._temp_dir_path / "geoip.metadb"
+        geoip.write_bytes(b"geoip")
+        for patch in [
+            mock.patch.dict(os.environ, {"no_proxy": "127.0.0.1", "NO_PROXY": "127.0.0.1"}),
+            mock.patch.object(envs, "get_geoip", lambda: geoip),
+            mock.patch.object(envs, "convert", mock.Mock(side_effect=lambda sub, tgt: shutil.copy(sub, tgt))),
+            mock.patch.object(envs, "ConfigManager", lambda: mock.Mock(get_config=SlashConfig)),
+            # check the subscription on every update
+            mock.patch.object(envs.SubscriptionCache, "max_age", 0),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.url = f"http://127.0.0.1:{server.server_address[1]}/sub"
+        self.env = Env(name="test_env", subscriptions=[self.url])
+
+    def test_update(self):
+        self.assertTrue(self.env.update())
+        self.assertEqual(envs.convert.call_count, 1)
+        version = self.env.config_version()
+
+        # not modified
+        self.assertTrue(self.env.update())
+        self.assertEqual(SubscriptionHandler.requests[-1]["If-None-Match"], '"v1"')
+        self.assertEqual(envs.convert.call_count, 1)
+        self.assertEqual(self.env.config_version(), version)
+
+        # a new etag, same content
+        SubscriptionHandler.etag = '"v2"'
+        self.assertTrue(self.env.update())
+        self.assertEqual(envs.convert.call_count, 1)
+        self.assertEqual(self.env.config_version(), version)
+
+        # new content
+        SubscriptionHandler.body, SubscriptionHandler.etag = b"name: other\n", '"v3"'
+        self.assertTrue(self.env.update())
+        self.assertEqual(envs.convert.call_count, 2)
+        self.assertNotEqual(self.env.config_version(), version)
+        self.assertEqual((self.env.workdir / "config.yaml").read_bytes(), b"name: other\n")
+
+    def test_create(self):
+        with mock.patch.object(envs.tempfile, "TemporaryDirectory", wraps=tempfile.TemporaryDirectory) as staging:
+            env = envs.EnvsManager().create_env(name="new_env", subscriptions=[self.url])
+        # staged next to the envs, so that the links survive the move
+        self.assertIn(envs.ENVS_DIR, [call.kwargs.get("dir") for call in staging.call_args_list])
+        cache = envs.SubscriptionCache(env.subscriptions)
+        self.assertTrue(os.path.samefile(cache.config_path, env.workdir / "config.yaml"))
+        self.assertTrue(os.path.samefile(
+            envs.ConfigSnapshot(cache.config_path, Env.codec).snapshot_path,
+            envs.ConfigSnapshot(env.workdir / "config.yaml", Env.codec).snapshot_path,
+        ))
+        self.assertTrue(os.path.samefile(envs.get_geoip(), env.workdir / "geoip.metadb"))
+
+        # a private copy of geoip.metadb is replaced by a link
+        (env.workdir / "geoip.metadb").unlink()
+        shutil.copy(envs.get_geoip(), env.workdir / "geoip.metadb")
+        self.assertTrue(env.update())
+        self.assertTrue(os.path.samefile(envs.get_geoip(), env.workdir / "geoip.metadb"))
+
+    def test_local(self):
+        sub = self._temp_dir_path / "sub.yaml"
+        sub.write_bytes(b"name: local\n")
+        env = Env(name="local_env", subscriptions=[str(sub)])
+        self.assertTrue(env.update())
+        self.assertEqual((env.workdir / "config.yaml").read_bytes(), b"name: local\n")
+
+        # converted again only if the file changed
+        self.assertTrue(env.update())
+        self.assertEqual(envs.convert.call_count, 1)
+        sub.write_bytes(b"name: changed\n")
+        self.assertTrue(env.update())
+        self.assertEqual(envs.convert.call_count, 2)
+        self.assertEqual((env.workdir / "config.yaml").read_bytes(), b"name: changed\n")
+        self.assertEqual(SubscriptionHandler.requests, [])
+
+    def test_failed_conversion(self):
+        envs.convert.side_effect = ValueError("bad subscription")
+        self.assertFalse(self.env.update())
+        cache = envs.SubscriptionCache(self.env.subscriptions)
+        self.assertFalse((cache.path / "subscription.tmp").exists())
+
+        # the next update downloads the subscription again
+        envs.convert.side_effect = lambda sub, tgt: shutil.copy(sub, tgt)
+        SubscriptionHandler.body = b"name: fixed\n"
+        self.assertTrue(self.env.update())
+        self.assertEqual(len(SubscriptionHandler.requests), 2)
+        self.assertEqual((self.env.workdir / "config.yaml").read_bytes(), b"name: fixed\n")
+
+    def test_shared(self):
+        other = Env(name="other_env", subscriptions=[self.url.replace("/sub", "/sub#other")])
+        with mock.patch.object(envs.SubscriptionCache, "max_age", 60):
+            self.assertTrue(self.env.update())
+            self.assertTrue(other.update())
+
+        # one download and conversion for both
+        self.assertEqual(len(SubscriptionHandler.requests), 1)
+        self.assertEqual(envs.convert.call_count, 1)
+        cache = envs.SubscriptionCache(other.subscriptions)
+        self.assertTrue(os.path.samefile(cache.config_path, other.workdir / "config.yaml"))
+
+        # editing the config of one env leaves the others alone
+        self.env.set_port(1234)
+        self.assertEqual((other.workdir / "config.yaml").read_bytes(), b"name: node\n")
+        self.assertEqual(cache.config_path.read_bytes(), b"name: node\n")
+
+        # a refresh by one env is picked up by the other without a conversion
+        SubscriptionHandler.body, SubscriptionHandler.etag = b"name: other\n", '"v2"'
+        self.assertTrue(self.env.update())
+        self.assertTrue(other.update())
+        self.assertEqual(envs.convert.call_count, 2)
+        self.assertEqual((other.workdir / "config.yaml").read_bytes(), b"name: other\n")
+
+
+class TestConvert(TesterMixin, unittest.TestCase):
+    # mimics subconverter, which changes to the directory it is run from, then either converts the subscription
+    # in generate.ini, or serves the /sub api on the port in its pref file
+    SUBCONVERTER = f"""#!{sys.executable}
+import configparser, os, sys, urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+os.chdir(os.path.dirname(sys.argv[0]))
+if "-g" in sys.argv:
+    generate = configparser.ConfigParser()
+    generate.read("generate.ini")
+    with open("output.yaml", "w") as f:
+        f.write(generate["test"]["url"] + "\\n")
+    sys.exit(0)
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        # local files need the token in the api mode
+        authorized = pref["common"]["api_mode"] != "true" or query.get("token") == pref["common"]["api_access_token"]
+        ok = url.path == "/version" or (url.path == "/sub" and authorized and os.path.exists(query["config"]))
+        body = (query.get("url", "") + "\\n").encode()
+        self.send_response(200 if ok else 400)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+pref = configparser.ConfigParser()
+pref.read(sys.argv[sys.argv.index("-f") + 1])
+HTTPServer((pref["server"]["listen"], int(pref["server"]["port"])), Handler).serve_forever()
+""".encode()
+
+    def make_tarball(self, digest):
+        path = self._temp_dir_path / digest
+        with tarfile.open(path, "w:gz") as tar:
+            for name, data, mode in [
+                ("subconverter/subconverter", self.SUBCONVERTER, 0o755),
+                ("subconverter/generate.ini", b"[stock]\n", 0o644),
+            ]:
+                info = tarfile.TarInfo(name)
+                info.size, info.mode = len(data), mode
+                tar.addfile(info, io.BytesIO(data))
+        return path
+
+    def setUp(self):
+        super().setUp()
+        template = self._temp_dir_path / "template.ini"
+        template.write_text("[custom]\n")
+        self.tarball = self.make_tarball("digest1")
+        self.config = SlashConfig()
+        for patch in [
+            mock.patch.object(envs, "get_subconverter_tarball", lambda: self.tarball),
+            mock.patch.object(envs, "get_template", lambda: template),
+            mock.patch.object(envs.tarfile, "open", wraps=tarfile.open),
+            mock.patch.object(envs, "ConfigManager", lambda: mock.Mock(get_config=lambda: self.config)),
+            mock.patch.dict(os.environ, {"no_proxy": "127.0.0.1", "NO_PROXY": "127.0.0.1"}),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_convert(self):
+        for i in range(2):
+            tgt = self._temp_dir_path / f"config{i}.yaml"
+            envs.convert(f"https://example.com/sub{i}", tgt)
+            self.assertEqual(tgt.read_text(), f"https://example.com/sub{i}\n")
+
+        # extracted once, and the extracted tree is left untouched
+        self.assertEqual(envs.tarfile.open.call_count, 1)
+        work_dir = envs.get_subconverter_dir()
+        self.assertEqual(work_dir, self._temp_dir_path / "subconverter" / "digest1" / "subconverter")
+        self.assertEqual((work_dir / "generate.ini").read_text(), "[stock]\n")
+        self.assertFalse((work_dir / "output.yaml").exists())
+
+        # a new tarball replaces the tree
+        self.tarball = self.make_tarball("digest2")
+        envs.tarfile.open.reset_mock()
+        envs.convert("https://example.com/sub", self._temp_dir_path / "config.yaml")
+        self.assertEqual(envs.tarfile.open.call_count, 1)
+        self.assertEqual([path.name for path in (self._temp_dir_path / "subconverter").iterdir()], ["digest2"])
+
+    def test_builtin(self):
+        # the default converter
+        self.config = SlashConfig()
+        sub = self._temp_dir_path / "sub"
+        tgt = self._temp_dir_path / "config.yaml"
+        sub.write_text("trojan://pass@a.com:443#Node\n")
+        envs.convert(sub, tgt)
+        self.assertEqual([proxy["name"] for proxy in YAML().load(tgt)["proxies"]], ["Node"])
+
+        # a link that the builtin converter does not support is left to subconverter
+        sub.write_text("trojan://pass@a.com:443#Node\nunknown://node\n")
+        envs.convert(sub, tgt)
+        self.assertEqual(tgt.read_text(), f"{sub}\n")
+
+        # subconverter on its own
+        self.config = SlashConfig(converter="subconverter")
+        sub.write_text("trojan://pass@a.com:443#Node\n")
+        envs.convert(sub, tgt)
+        self.assertEqual(tgt.read_text(), f"{sub}\n")
+
+    def test_server(self):
+        self.config = SlashConfig(subconverter_server=True)
+        threads = []
+        def spawn(server):
+            threads.append(threading.Thread(target=server.serve, daemon=True))
+            threads[-1].start()
+
+        with mock.patch.multiple(envs.SubconverterServer, spawn=spawn, interval=0.1, idle_timeout=1):
+            for i in range(2):
+                tgt = self._temp_dir_path / f"config{i}.yaml"
+                envs.convert(f"https://example.com/sub{i}", tgt)
+                self.assertEqual(tgt.read_text(), f"https://example.com/sub{i}\n")
+
+            # one server for both, which shuts down when idle
+            self.assertEqual(len(threads), 1)
+            server = envs.SubconverterServer()
+            state = server.load()
+            self.assertIsNotNone(state)
+
+            # the token is private, and required
+            for path in [server.state_path, server.workdir / "pref.ini"]:
+                self.assertEqual(path.stat().st_mode & 0o777, 0o600)
+            response = requests.get(
+                f"http://127.0.0.1:{state['port']}/sub", params={"config": str(server.workdir / "pref.ini"), "url": "x"}
+            )
+            self.assertEqual(response.status_code, 400)
+            threads[0].join(timeout=10)
+            self.assertFalse(threads[0].is_alive())
+            self.assertIsNone(envs.SubconverterServer().load())
+            self.assertFalse((Path("/proc") / str(state["server_pid"])).exists())
+
+    def test_server_state(self):
+        server = envs.SubconverterServer()
+        self.assertEqual(server.state_path.name, f"{socket.gethostname()}.json")
+        server.root.mkdir(parents=True)
+
+        # a live process that reused the pid of the server is neither taken for the server nor signalled
+        proc = subprocess.Popen(["sleep", "60"])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        created = psutil.Process(proc.pid).create_time()
+        state = {"pid": proc.pid, "pid_created": created - 1, "server_pid": proc.pid, "server_pid_created": created - 1}
+        server.state_path.write_text(json.dumps(state))
+        self.assertIsNone(server.load())
+        server.stop()
+        self.assertIsNone(proc.poll())
+        self.assertFalse(server.state_path.exists())
+
+    def test_server_failure(self):
+        # any failure of the server falls back to running subconverter once
+        self.config = SlashConfig(subconverter_server=True)
+        with mock.patch.object(envs.SubconverterServer, "convert", side_effect=PermissionError("not ours")):
+            tgt = self._temp_dir_path / "config.yaml"
+            envs.convert("https://example.com/sub", tgt)
+            self.assertEqual(tgt.read_text(), "https://example.com/sub\n")
+
+
+class TestEnvRegistry(TesterMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = envs.EnvsManager()
+
+        # ensure that we are using the temporary directory
+        self.assertTrue(self._temp_dir_path in self.manager.registry.root.parents)
+
+    def test_get_env(self):
+        base = self.manager.get_env("base")
+        self.assertEqual(base.name, "base")
+        self.assertIs(self.manager.get_env("base"), base)
+        self.assertIsNone(self.manager.get_env("missing"))
+        self.assertIsNone(self.manager.get_env("../envs/base"))
+
+        # a saved env is parsed again
+        base.last_updated = "2024-12-27 00:00:00"
+        base.save()
+        self.assertIsNot(self.manager.get_env("base"), base)
+        self.assertEqual(self.manager.get_env("base").last_updated, "2024-12-27 00:00:00")
+
+    def test_envs(self):
+        self.assertEqual(list(self.manager.envs), ["base"])
+        Env(name="test_env").save()
+        self.assertEqual(list(self.manager.envs), ["base", "test_env"])
+
+        # the env is removed behind the back of the registry
+        envs.Env(name="test_env").destroy()
+        self.assertEqual(list(self.manager.envs), ["base"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import unittest
+from unittest import mock
+
+from slash.core.envs import Env
+from slash.core.service import ActivationCache, Service, ServiceManager
+
+from .test_common import TesterMixin
+
+
+class TestActivationCache(TesterMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.env = Env(name="test_env")
+        self.env.workdir.mkdir(parents=True)
+        self.cache = ActivationCache(self.env.name)
+
+        # ensure that we are using the temporary directory
+        self.assertTrue(self._temp_dir_path in self.cache.path.parents)
+
+    def test_save(self):
+        service = Service(os.getpid(), 23456, (23457, "secret"), self.env, ["__pid_1_with__"])
+        service.save()
+        with open(self.cache.path) as f:
+            self.assertEqual(f.read().split(), [str(os.getpid()), "23456"])
+
+        dead = Service(2 ** 22 + 1, 23456, (23457, "secret"), self.env, [])
+        dead.save()
+        self.assertFalse(self.cache.path.exists())
+
+    def test_merge_hook_jobs(self):
+        Service(os.getpid(), 23456, (23457, "secret"), self.env, ["__pid_1_with__"]).save()
+        with open(self.cache.jobs_path, "a") as f:
+            f.write("__pid_2_shell__\n")
+
+        service = Service.load(self.env)
+        self.assertEqual(service.jobs, ["__pid_1_with__", "__pid_2_shell__"])
+
+        # a job registered while the service is loaded is not lost
+        with open(self.cache.jobs_path, "a") as f:
+            f.write("__pid_3_shell__\n")
+        service.jobs.remove("__pid_2_shell__")
+        service.save()
+
+        self.assertEqual(self.cache.pending(), [])
+        with open(self.env.workdir / "service.json") as f:
+            jobs = next(iter(json.load(f).values()))["jobs"]
+        self.assertEqual(jobs, ["__pid_1_with__", "__pid_3_shell__"])
+
+
+class TestServiceManager(TesterMixin, unittest.TestCase):
+    def test_get_service(self):
+        env, other = Env(name="test_env"), Env(name="other_env")
+        env.save()
+        other.save()
+        Service(os.getpid(), 23456, (23457, "secret"), env, ["__pid_1_with__"]).save()
+
+        manager = ServiceManager()
+        service = manager.get_service(env)
+        self.assertEqual((service.pid, service.port, service.jobs), (os.getpid(), 23456, ["__pid_1_with__"]))
+        self.assertIsNone(manager.get_service(other))
+
+    def test_stop_with_hook_job(self):
+        env = Env(name="test_env")
+        env.save()
+        proc = subprocess.Popen(["sleep", "60"])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        Service(proc.pid, 23456, (23457, "secret"), env, ["__pid_1_with__"]).save()
+        cache = ActivationCache(env.name)
+
+        # a shell registers its job after the service is loaded, before the fast path is closed
+        remove = ActivationCache.remove
+        def register_then_remove(self):
+            with open(self.jobs_path, "a") as f:
+                f.write("__pid_2_shell__\n")
+            remove(self)
+
+        manager = ServiceManager()
+        with mock.patch.object(ActivationCache, "remove", register_then_remove):
+            manager.stop(env, "__pid_1_with__")
+        self.assertIsNone(proc.poll())
+        self.assertEqual(manager.get_service(env).jobs, ["__pid_2_shell__"])
+        self.assertTrue(cache.path.exists())
+
+        # a hook job that fell back to the full path is adopted, not rejected
+        with open(cache.jobs_path, "a") as f:
+            f.write("__pid_3_shell__\n")
+        self.assertEqual(manager.launch(env, "__pid_3_shell__").jobs, ["__pid_2_shell__", "__pid_3_shell__"])
+        with self.assertRaises(ValueError):
+            manager.launch(env, "__pid_3_shell__")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import unittest
+from pathlib import Path
+
+from slash.core import shell
+from slash.core.service import ActivationCache
+
+from .test_common import TesterMixin
+
+
+class TestShellHook(TesterMixin, unittest.TestCase):
+    def test_write_hook(self):
+        slash_exe = Path("/opt/slash/bin/slash")
+        path = shell.write_hook(slash_exe)
+        self.assertEqual(path, self._temp_dir_path / "hook.sh")
+        with open(path) as f:
+            self.assertIn(shell.hook(slash_exe), f.read())
+
+        # the cached hook defines the shell function on its own
+        out = subprocess.run(["bash", "-c", f". '{path}' && type slash"], capture_output=True, text=True)
+        self.assertEqual(out.returncode, 0)
+        self.assertIn("__slash_activate", out.stdout)
+
+    def test_activate_cached(self):
+        path = shell.write_hook(Path("/nonexistent/slash"))
+        cache = ActivationCache("test_env")
+        cache.write(os.getpid(), 23456)
+
+        script = f". '{path}'; unset http_proxy https_proxy SLASH_ENV; slash activate test_env && echo $http_proxy $SLASH_ENV"
+        out = subprocess.run(["bash", "-c", script], capture_output=True, text=True)
+        self.assertEqual(out.stdout.strip(), "http://127.0.0.1:23456 test_env")
+        self.assertEqual(len(cache.pending()), 1)
+
+        # a dead service falls back to slash, which does not exist here
+        cache.write(2 ** 22 + 1, 23456)
+        out = subprocess.run(["bash", "-c", script], capture_output=True, text=True)
+        self.assertNotEqual(out.returncode, 0)
+        self.assertEqual(len(cache.pending()), 1)
+
+        # a stop that closes the fast path right after the job is registered, falls back to slash as well
+        cache.write(os.getpid(), 23456)
+        race = f'printf() {{ builtin printf "$@"; rm -f "{cache.path}"; }}; '
+        out = subprocess.run(["bash", "-c", race + script], capture_output=True, text=True)
+        self.assertNotEqual(out.returncode, 0)
+        self.assertEqual(out.stdout.strip(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from slash.core import envs
+from slash.slash import Slash
+
+from .test_common import TesterMixin
+
+
+SCRIPT = """
+import os, sys
+from types import SimpleNamespace
+from slash.slash import Slash
+
+print(os.getpid(), flush=True)
+Slash.daemons = []
+Slash.launch = lambda self, job: print(job, flush=True) or SimpleNamespace(port=23456)
+sys.argv = ["slash", "run", "--exec", "sh", "-c", "echo $$ $http_proxy; exit 3"]
+
+import slash
+slash.main()
+"""
+
+
+class TestSlashRun(unittest.TestCase):
+    def test_exec(self):
+        with tempfile.TemporaryDirectory() as home:
+            env = dict(os.environ, HOME=home)
+            env.pop("http_proxy", None)
+            out = subprocess.run([sys.executable, "-c", SCRIPT], env=env, capture_output=True, text=True)
+
+        pid, job, result = out.stdout.splitlines()
+        self.assertEqual(job, f"__pid_{pid}_run__")
+
+        # the command replaces slash, and its exit code passes through
+        self.assertEqual(result, f"{pid} http://127.0.0.1:23456")
+        self.assertEqual(out.returncode, 3)
+
+
+class TestSlashUpdate(TesterMixin, unittest.TestCase):
+    def test_update_many(self):
+        manager = envs.EnvsManager()
+        for name in ["a", "b", "c"]:
+            envs.Env(name).save()
+
+        # a and b are only released when both are updating
+        barrier = threading.Barrier(2, timeout=10)
+        def update(env):
+            if env.name in ("a", "b"):
+                barrier.wait()
+            # b is unchanged, so its service is not reloaded
+            if env.name == "a":
+                (env.workdir / "config.yaml").write_text("rules: []\n")
+            return env.name != "c"
+
+        service = mock.Mock()
+        with mock.patch.object(Slash, "envs_manager", manager), \
+             mock.patch.object(Slash, "service_manager", mock.Mock(get_service=lambda env: service)), \
+             mock.patch.object(envs.Env, "update", update):
+            failed = Slash.update_many(["a", "b", "c", "missing"], workers=2)
+
+        self.assertEqual(failed, ["c", "missing"])
+        # the services of the changed envs only
+        self.assertEqual(service.update.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
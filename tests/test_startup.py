@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+
+# the third-party modules that should only be imported when they are used
+HEAVY_MODULES = ["requests", "rich", "faker", "psutil", "ruamel", "filelock"]
+
+# generous, the heavy modules alone take several hundred milliseconds
+IMPORT_BUDGET = 0.2
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import slash
+slash.Slash
+elapsed = time.perf_counter() - start
+
+sys.argv = ["slash", "shell", "hook"]
+slash.main()
+loaded = sorted({name.split(".")[0] for name in sys.modules} & set(%r))
+print(json.dumps({"elapsed": elapsed, "loaded": loaded}))
+"""
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.home = Path(self._temp_dir.name)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def run_script(self) -> dict:
+        env = dict(os.environ, HOME=str(self.home))
+        out = subprocess.run(
+            [sys.executable, "-c", SCRIPT % HEAVY_MODULES], env=env, capture_output=True, text=True, check=True
+        )
+        return json.loads(out.stdout.splitlines()[-1])
+
+    def test_lazy_imports(self):
+        result = self.run_script()
+        self.assertEqual(result["loaded"], [])
+
+        # importing has no side effects on disk
+        self.assertFalse((self.home / ".cache" / "slash").exists())
+
+    def test_import_budget(self):
+        self.run_script() # warm up the bytecode cache
+        result = self.run_script()
+        self.assertLess(result["elapsed"], IMPORT_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
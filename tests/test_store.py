@@ -0,0 +1,88 @@
+import errno
+import os
+import unittest
+from unittest import mock
+
+from slash.core.store import ArtifactStore, sha256sum
+
+from .test_common import TesterMixin
+
+
+class TestArtifactStore(TesterMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = ArtifactStore()
+
+        # ensure that we are using the temporary directory
+        self.assertTrue(self._temp_dir_path in self.store.root.parents)
+
+    def make_file(self, content: bytes, name: str = "artifact"):
+        path = self._temp_dir_path / name
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_put_get(self):
+        blob = self.store.put("https://example.com/a", self.make_file(b"hello"))
+        self.assertEqual(blob.name, sha256sum(blob))
+        self.assertEqual(self.store.get("https://example.com/a"), blob)
+        self.assertIsNone(self.store.get("https://example.com/b"))
+        self.assertIsNone(self.store.get("https://example.com/a", max_age=-1))
+
+    def test_fetch_hit(self):
+        blob = self.store.put("https://example.com/a", self.make_file(b"hello"))
+
+        def urls():
+            self.fail("urls should not be resolved on a cache hit")
+
+        self.assertEqual(self.store.fetch("https://example.com/a", urls), blob)
+
+    def test_corrupted(self):
+        blob = self.store.put("https://example.com/a", self.make_file(b"hello"))
+        blob.chmod(0o644)
+        with open(blob, "wb") as f:
+            f.write(b"hel")
+        self.assertIsNone(self.store.get("https://example.com/a"))
+
+    def test_link(self):
+        blob = self.store.put("https://example.com/a", self.make_file(b"hello"))
+        target = self._temp_dir_path / "envs" / "test_env" / "geoip.metadb"
+        self.store.link(blob, target)
+        self.assertTrue(os.path.samefile(blob, target))
+        self.assertEqual(blob.stat().st_nlink, 2)
+
+        # the link does not invalidate the blob
+        self.assertEqual(self.store.get("https://example.com/a"), blob)
+
+    def test_link_fallback(self):
+        blob = self.store.put("https://example.com/a", self.make_file(b"hello"))
+        target = self._temp_dir_path / "copy"
+        with mock.patch("os.link", side_effect=OSError(errno.EXDEV, "cross-device link")):
+            self.store.link(blob, target)
+        self.assertFalse(os.path.samefile(blob, target))
+        self.assertEqual(target.read_bytes(), b"hello")
+
+        # other errors are not hidden by a copy
+        target = self._temp_dir_path / "denied"
+        with mock.patch("os.link", side_effect=OSError(errno.EACCES, "permission denied")):
+            with self.assertRaises(PermissionError):
+                self.store.link(blob, target)
+        self.assertFalse(target.exists())
+        self.assertEqual([p.name for p in target.parent.glob(".denied.*")], [])
+
+    def test_gc(self):
+        old = self.store.put("https://example.com/a", self.make_file(b"old"))
+        new = self.store.put("https://example.com/a", self.make_file(b"new"))
+        self.assertFalse(old.exists())
+
+        linked = self.store.put("https://example.com/b", self.make_file(b"linked"))
+        self.store.link(linked, self._temp_dir_path / "link")
+        self.store.gc(max_size=0)
+        self.assertFalse(new.exists())
+        self.assertTrue(linked.exists())
+        self.assertIsNone(self.store.get("https://example.com/a"))
+        self.assertEqual(self.store.get("https://example.com/b"), linked)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,349 @@
+import gzip
+import json
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+import slash.utils as utils
+
+
+class FakeResponse:
+    def __init__(self, url: str):
+        self.url = url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestMirrorRules(unittest.TestCase):
+    def test_expand(self):
+        url = "https://raw.githubusercontent.com/zsokami/ACL4SSR/main/ACL4SSR_Online_Mannix.ini"
+        urls = utils.expand_urls(url)
+        self.assertEqual(urls[0], url)
+        self.assertIn("https://cdn.jsdelivr.net/gh/zsokami/ACL4SSR@main/ACL4SSR_Online_Mannix.ini", urls)
+        self.assertIn(f"https://ghproxy.net/{url}", urls)
+        self.assertEqual(len(urls), len(set(urls)))
+
+    def test_host_keyed(self):
+        rules = utils.MirrorRules([
+            [r"^https?://example.com/(.*)$", [r"https://a.mirror/\g<1>", r"https://a.mirror/\g<1>"]],
+            [r"^https?://example.org/(.*)$", [r"https://b.mirror/\g<0>"]],
+        ])
+        self.assertEqual(rules.expand("https://example.com/x"), ["https://example.com/x", "https://a.mirror/x"])
+        self.assertEqual(rules.expand("https://example.org/x"), ["https://example.org/x", "https://b.mirror/https://example.org/x"])
+        self.assertEqual(rules.expand("https://example.net/x"), ["https://example.net/x"])
+
+    def test_no_match(self):
+        self.assertEqual(utils.expand_urls(["https://example.com/sub", "https://example.com/sub"]), ["https://example.com/sub"])
+
+
+class TestOpenFastest(unittest.TestCase):
+    def setUp(self):
+        utils.logger.mute()
+
+    def tearDown(self):
+        utils.logger.unmute()
+
+    def test_fastest_wins(self):
+        delays = {"slow": 0.5, "fast": 0.01, "dead": 0.0}
+        responses = []
+
+        def open_url(url):
+            time.sleep(delays[url])
+            if url == "dead":
+                raise requests.exceptions.ConnectionError(url)
+            response = FakeResponse(url)
+            responses.append(response)
+            return response
+
+        candidates = list(enumerate(["slow", "dead", "fast"]))
+        start = time.time()
+        winner, failed = utils._open_fastest(candidates, open_url, race=3)
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(winner[:2], (2, "fast"))
+        self.assertEqual(failed, [(1, "dead")])
+
+        # the late response is closed
+        time.sleep(0.6)
+        slow = [r for r in responses if r.url == "slow"]
+        self.assertEqual(len(slow), 1)
+        self.assertTrue(slow[0].closed)
+
+    def test_bounded(self):
+        lock = threading.Lock()
+        running, peak = 0, 0
+
+        def open_url(url):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+            raise requests.exceptions.ConnectionError(url)
+
+        candidates = list(enumerate(f"url{i}" for i in range(10)))
+        winner, failed = utils._open_fastest(candidates, open_url, race=2)
+        self.assertIsNone(winner)
+        self.assertEqual(len(failed), 10)
+        self.assertLessEqual(peak, 2)
+
+    def test_unexpected_error(self):
+        def open_url(url):
+            if url == "broken":
+                raise ValueError(url)
+            return FakeResponse(url)
+
+        candidates = list(enumerate(["broken", "ok"]))
+        winner, failed = utils._open_fastest(candidates, open_url, race=1)
+        self.assertEqual(winner[:2], (1, "ok"))
+        self.assertEqual(failed, [(0, "broken")])
+
+
+class TestMirrorScoreboard(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.scoreboard = utils.MirrorScoreboard(Path(self._temp_dir.name) / "mirrors.log")
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_sort(self):
+        urls = ["https://dead.example/a", "https://unknown.example/a", "https://slow.example/a", "https://fast.example/a"]
+        for _ in range(3):
+            self.scoreboard.record(urls[0], ok=False)
+        self.scoreboard.record(urls[2], ok=True, ttfb=3.0)
+        self.scoreboard.record(urls[3], ok=True, ttfb=0.1, speed=10 << 20)
+        self.assertEqual(self.scoreboard.sort(urls), [urls[3], urls[1], urls[2], urls[0]])
+
+    def test_decay(self):
+        self.scoreboard.record("https://dead.example/a", ok=False)
+        with open(self.scoreboard.path, "a") as f:
+            f.write("torn line\n")
+        stats = self.scoreboard.stats()
+        self.assertAlmostEqual(stats["dead.example"]["f"], 1.0, places=3)
+
+        # a failure a month ago barely counts
+        with open(self.scoreboard.path, "w") as f:
+            f.write(json.dumps({"host": "dead.example", "t": time.time() - 30 * 24 * 3600, "s": 0, "f": 1}) + "\n")
+        stats = self.scoreboard.stats()
+        self.assertLess(stats["dead.example"]["f"], 1e-6)
+
+    def test_compact(self):
+        self.scoreboard.max_size = 100
+        for _ in range(10):
+            self.scoreboard.record("https://fast.example/a", ok=True, ttfb=0.1)
+        before = self.scoreboard.stats()
+        with open(self.scoreboard.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        after = self.scoreboard.stats()
+        self.assertAlmostEqual(before["fast.example"]["s"], after["fast.example"]["s"], places=3)
+
+
+class TestPartialDownload(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self._temp_dir.name) / "artifact"
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_resume_headers(self):
+        state = utils.PartialDownload(self.path)
+        self.assertEqual(state.headers("https://a.example/x"), {})
+
+        state.meta = {"url": "https://a.example/x", "etag": '"abc"', "last_modified": None, "length": 100}
+        state.save()
+        with open(state.part, "wb") as f:
+            f.write(b"0" * 40)
+
+        state = utils.PartialDownload(self.path)
+        self.assertEqual(state.headers("https://a.example/y"), {"Range": "bytes=40-", "If-Range": '"abc"'})
+        self.assertEqual(state.headers("https://b.example/x"), {"Range": "bytes=40-"})
+
+    def test_orphan_part(self):
+        with open(self.path.with_name("artifact.part"), "wb") as f:
+            f.write(b"0" * 40)
+        state = utils.PartialDownload(self.path)
+        self.assertEqual(state.offset, 0)
+        self.assertFalse(state.part.exists())
+
+    def test_plan(self):
+        state = utils.PartialDownload(self.path)
+        state.meta = {"url": "https://a.example/x", "length": 10 * state.min_segment + 3}
+        self.assertFalse(state.plan(1))
+        self.assertTrue(state.plan(4))
+        segments = state.meta["segments"]
+        self.assertEqual(len(segments), 4)
+        self.assertEqual(segments[0][0], 0)
+        self.assertEqual(segments[-1][1], state.meta["length"] - 1)
+        for prev, cur in zip(segments, segments[1:]):
+            self.assertEqual(prev[1] + 1, cur[0])
+        self.assertEqual(state.part.stat().st_size, state.meta["length"])
+
+    def test_segments(self):
+        data = bytes(range(256)) * 64
+        state = utils.PartialDownload(self.path)
+        state.min_segment = 1024
+        state.meta = {"url": "https://a.example/x", "length": len(data)}
+        self.assertTrue(state.plan(4))
+
+        def open_range(url, start, end):
+            if url == "https://broken.example/x":
+                raise ValueError(url)
+            total = len(data) + 1 if url == "https://other.example/x" else len(data)
+            r = mock.MagicMock(status_code=206, headers={"Content-Range": f"bytes {start}-{end}/{total}"})
+            r.__enter__.return_value = r
+            r.iter_content.return_value = [data[start:end + 1]]
+            return r
+
+        utils.logger.mute()
+        self.addCleanup(utils.logger.unmute)
+        with mock.patch.object(utils, "mirrors"):
+            # a mirror with another version of the file is skipped
+            urls = ["https://other.example/x", "https://a.example/x"]
+            utils._download_segments(urls, state, open_range, lambda n: None)
+            self.assertEqual(state.part.read_bytes(), data)
+
+            # an unexpected error fails the download instead of leaving a hole
+            state.reset()
+            state.meta = {"url": "https://a.example/x", "length": len(data)}
+            state.plan(4)
+            with self.assertRaises(requests.exceptions.RequestException):
+                utils._download_segments(["https://broken.example/x"], state, open_range, lambda n: None)
+
+
+class TestGunzip(unittest.TestCase):
+    def test_chunks(self):
+        data = b"slash" * 100000
+        compressed = gzip.compress(data)
+        decoder = utils.Gunzip()
+        out = b"".join(decoder.feed(compressed[i:i + 1000]) for i in range(0, len(compressed), 1000))
+        self.assertEqual(out + decoder.flush(), data)
+
+    def test_truncated(self):
+        compressed = gzip.compress(b"slash" * 100000)
+        decoder = utils.Gunzip()
+        decoder.feed(compressed[:len(compressed) // 2])
+        with self.assertRaises(ValueError):
+            decoder.flush()
+
+    def test_corrupted(self):
+        with self.assertRaises(ValueError):
+            utils.Gunzip().feed(b"\x1f\x8b\x08\x00" + b"\xff" * 64)
+
+
+class TestDownloadFile(unittest.TestCase):
+    def setUp(self):
+        utils.logger.mute()
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self._temp_dir.name) / "artifact"
+        self.bodies = {}
+        session = mock.Mock()
+        session.get.side_effect = lambda url, **kwargs: self.response(self.bodies[url])
+        self.patches = [
+            mock.patch.object(utils, "get_session", return_value=session),
+            mock.patch.object(utils.mirrors, "sort", side_effect=lambda urls: urls),
+            mock.patch.object(utils.mirrors, "record"),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self._temp_dir.cleanup()
+        utils.logger.unmute()
+
+    @staticmethod
+    def response(body: bytes):
+        r = mock.MagicMock(status_code=200, headers={"Content-Length": str(len(body))})
+        r.__enter__.return_value = r
+        r.iter_content.return_value = [body]
+        return r
+
+    def test_transform_fallback(self):
+        data = b"slash" * 100000
+        compressed = gzip.compress(data)
+        urls = ["https://a.example/x.gz", "https://b.example/x.gz"]
+        self.bodies = {urls[0]: compressed[:len(compressed) // 2], urls[1]: compressed}
+
+        # a truncated stream is a failure of the mirror, the next one is tried
+        utils.download_file(urls, self.path, race=1, transform=utils.Gunzip)
+        self.assertEqual(self.path.read_bytes(), data)
+        self.assertEqual([p.name for p in self.path.parent.iterdir()], ["artifact"])
+
+    def test_transform_failed(self):
+        url = "https://a.example/x.gz"
+        self.bodies = {url: b"not gzip"}
+        with self.assertRaises(requests.exceptions.RequestException):
+            utils.download_file(url, self.path, race=1, transform=utils.Gunzip)
+        # the staging file does not leak
+        self.assertEqual(list(self.path.parent.iterdir()), [])
+
+
+class FakeApiResponse:
+    def __init__(self, status_code, data=None, etag=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = {"ETag": etag} if etag else {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def json(self):
+        return self.data
+
+
+class TestReleaseCache(unittest.TestCase):
+    repo = "MetaCubeX/subconverter"
+    release = {"assets": [{"name": "a.tar.gz", "browser_download_url": "https://github.com/x/a.tar.gz"}]}
+
+    def setUp(self):
+        utils.logger.mute()
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.cache = utils.ReleaseCache(Path(self._temp_dir.name) / "releases.json")
+        self.patches = [
+            mock.patch.object(utils, "releases", self.cache),
+            mock.patch.object(utils, "mirrors", utils.MirrorScoreboard(Path(self._temp_dir.name) / "mirrors.log")),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self._temp_dir.cleanup()
+        utils.logger.unmute()
+
+    def test_fresh(self):
+        with mock.patch.object(utils.requests.Session, "get", return_value=FakeApiResponse(200, self.release, '"v1"')) as get:
+            self.assertEqual(utils.get_latest_github_release(self.repo, "a.tar.gz"), "https://github.com/x/a.tar.gz")
+            self.assertEqual(utils.get_latest_github_release(self.repo, "a.tar.gz"), "https://github.com/x/a.tar.gz")
+            self.assertEqual(get.call_count, 1)
+
+    def test_revalidate(self):
+        with mock.patch.object(utils.requests.Session, "get", return_value=FakeApiResponse(200, self.release, '"v1"')):
+            utils.get_latest_github_release(self.repo, "a.tar.gz")
+        with mock.patch.object(utils.requests.Session, "get", return_value=FakeApiResponse(304)) as get:
+            self.assertEqual(utils.get_latest_github_release(self.repo, "a.tar.gz", ttl=0), "https://github.com/x/a.tar.gz")
+            self.assertEqual(get.call_args.kwargs["headers"], {"If-None-Match": '"v1"'})
+
+    def test_stale(self):
+        with mock.patch.object(utils.requests.Session, "get", return_value=FakeApiResponse(200, self.release, '"v1"')):
+            utils.get_latest_github_release(self.repo, "a.tar.gz")
+        with mock.patch.object(utils.requests.Session, "get", side_effect=requests.exceptions.ConnectionError()):
+            self.assertEqual(utils.get_latest_github_release(self.repo, "a.tar.gz", ttl=0), "https://github.com/x/a.tar.gz")
+            self.assertIsNone(utils.get_latest_github_release("x/y", "a.tar.gz", ttl=0))
+
+
+if __name__ == "__main__":
+    unittest.main()